@@ -0,0 +1,1115 @@
+# -*- coding: utf-8 -*-
+"""Micro-benchmarks for the bot's hot paths.
+
+Usage:
+    python bench.py seen [--stored 100000] [--candidates 1000]
+    python bench.py extract [--corpus DIR_OF_SAVED_HTML_PAGES]
+    python bench.py mapreduce [--candidates 5000] [--latency 0.5]
+    python bench.py freshness [--feeds 500] [--entries 100]
+    python bench.py llm [--calls 40] [--slow-rate 0.1] [--hedge-after 0.5]
+    python bench.py broadcast [--recipients 500] [--rate 20] [--limit 25]
+    python bench.py mock-graph [--port 8089] [--limit 25]   (then WHATSAPP_GRAPH_URL=http://127.0.0.1:8089/v22.0)
+    python bench.py record DIR [--mode all] [--deliver]      (live network + Gemini, writes replay fixtures)
+    python bench.py synth DIR [--feeds 200] [--entries 50]   (scaled synthetic fixtures)
+    python bench.py replay DIR [--modes research news all]   (offline job() runs with per-stage stats)
+    python bench.py archive [--years 3] [--per-day 40]       (FTS5 archive search over a synthetic archive)
+    python bench.py golden [--mode news]                     (digest render/chunk checks, non-zero on regression)
+    python bench.py startup [--runs 5] [--max-ms 800]        (cold start to first network request)
+"""
+import os
+import re
+import sys
+import json
+import time
+import base64
+import random
+import hashlib
+import threading
+import sqlite3
+import argparse
+import tempfile
+import calendar
+import statistics
+import subprocess
+import tracemalloc
+from collections import deque, defaultdict
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import bot
+import requests
+from bs4 import BeautifulSoup
+
+
+def _timed(fn, repeat=5):
+    """Best-of-N wall time in seconds, plus the last return value."""
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_seen(args):
+    """Seen-URL lookups at scale: legacy connection-per-check on the seen_urls table vs the
+    seen_state segments (migration, load, batch membership, one save, compaction)."""
+    tmp = tempfile.mkdtemp()
+    bot.DB_FILE = os.path.join(tmp, "bench_seen.db")
+    bot.SEEN_STATE_DIR = os.path.join(tmp, "seen_state")
+    bot.init_db()
+    conn = bot.get_db()
+    conn.executemany("INSERT INTO seen_urls (url, timestamp) VALUES (?, datetime('now', ?))",
+                     [(f"https://example.com/story/{i}", f"-{i % 90} days") for i in range(args.stored)])
+    conn.commit()
+    candidates = [f"https://example.com/story/{i * 7}" for i in range(args.candidates)]
+
+    def legacy():
+        hits = 0
+        for url in candidates:
+            c = sqlite3.connect(bot.DB_FILE)
+            hits += c.execute("SELECT 1 FROM seen_urls WHERE url = ?", (url,)).fetchone() is not None
+            c.close()
+        return hits
+
+    migrate_s, migrated = _timed(lambda: bot.migrate_seen_urls(bot.SeenStore(), conn), repeat=1)
+    load_s, store = _timed(lambda: bot.SeenStore(), repeat=3)
+    legacy_s, legacy_hits = _timed(legacy, repeat=3)
+    batch_s, seen = _timed(lambda: store.seen_many(candidates))
+    sent = [f"https://example.com/new/{i}" for i in range(30)]
+    save_s, _ = _timed(lambda: store.add_many(sent, {u: random.getrandbits(64) for u in sent}), repeat=1)
+    save_bytes = os.path.getsize(os.path.join(store.path, store.segments[-1]))
+    compact_s, dropped = _timed(lambda: bot.SeenStore().compact(), repeat=1)
+    state_bytes = sum(os.path.getsize(os.path.join(store.path, n)) for n in os.listdir(store.path))
+
+    print(f"stored URLs:               {args.stored:,} ({migrated:,} migrated from seen_urls)")
+    print(f"candidates checked:        {args.candidates:,} ({legacy_hits:,} in table, {len(seen):,} within "
+          f"{bot.SEEN_RETENTION_DAYS} days)")
+    print(f"migration:                 {migrate_s * 1000:9.2f} ms (once)")
+    print(f"SeenStore load:            {load_s * 1000:9.2f} ms (once per process)")
+    print(f"legacy is_url_seen loop:   {legacy_s * 1000:9.2f} ms ({legacy_s / args.candidates * 1e6:.1f} us/url)")
+    print(f"SeenStore.seen_many:       {batch_s * 1000:9.2f} ms ({batch_s / args.candidates * 1e6:.3f} us/url)")
+    print(f"save of {len(sent)} URLs:          {save_s * 1000:9.2f} ms ({save_bytes:,} byte segment)")
+    print(f"compaction:                {compact_s * 1000:9.2f} ms ({dropped:,} expired lines dropped)")
+    print(f"state size:                seen_state {state_bytes / 1e6:.2f} MB vs seen_urls.db "
+          f"{os.path.getsize(bot.DB_FILE) / 1e6:.2f} MB")
+    bot.close_db()
+
+
+def _synthetic_page(paragraphs, script_kb, seed=0):
+    """Article-shaped HTML: a heavy <head>, navigation boilerplate, then the story paragraphs."""
+    words = "model training latency benchmark release open weights startup funding policy chip".split()
+    body = "".join(
+        f"<p>{' '.join(words[(seed + i + j) % len(words)] for j in range(40))}.</p>\n" for i in range(paragraphs))
+    nav = "".join(f'<li><a href="/section/{i}">Section {i}</a></li>' for i in range(200))
+    script = "<script>" + ("var x = '<p>not text</p>';" * (script_kb * 40)) + "</script>"
+    return (f"<html><head><title>Story</title>{script}</head><body><nav><ul>{nav}</ul></nav>"
+            f"<article>{body}</article><footer>{nav}</footer></body></html>").encode()
+
+
+def _legacy_extract(content):
+    """The pre-streaming implementation: full download, full soup, text of every <p>."""
+    soup = BeautifulSoup(content, 'html.parser')
+    paragraphs = soup.find_all('p')
+    text = " ".join([p.get_text(strip=True) for p in paragraphs if len(p.get_text(strip=True)) > 20])
+    return text[:1000]
+
+
+def _measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def bench_extract(args):
+    """Deep-article extraction: BeautifulSoup over the whole page vs the streaming TextExtractor.
+    Timings only count pages where both paths extract the same text."""
+    if args.corpus:
+        pages = [(name, open(os.path.join(args.corpus, name), 'rb').read())
+                 for name in sorted(os.listdir(args.corpus)) if name.endswith(('.html', '.htm'))]
+    else:
+        pages = [(f"synthetic-{n}p-{kb}kb", _synthetic_page(n, kb, seed=n))
+                 for n, kb in ((20, 10), (60, 60), (150, 200), (400, 800))]
+    if not pages:
+        print(f"No .html files in {args.corpus}")
+        return 1
+
+    chunk = 16384
+    totals = [0.0, 0.0, 0, 0]
+    mismatches = 0
+    print(f"{'page':<28}{'size':>10}{'bs4 ms':>10}{'bs4 peak':>11}{'stream ms':>11}{'stream peak':>13}{'read':>10}")
+    for name, content in pages:
+        consumed = [0]
+
+        def chunks():
+            for i in range(0, len(content), chunk):
+                consumed[0] = i + chunk
+                yield content[i:i + chunk]
+
+        legacy_s, legacy_peak, expected = _measure(lambda: _legacy_extract(content))
+        stream_s, stream_peak, text = _measure(lambda: bot.extract_paragraphs(chunks()))
+        if text is None:
+            print(f"{name[:27]:<28}{len(content) / 1024:>8.0f}KB  ⚠️ no text within {bot.DEEP_FETCH_MAX_BYTES // 1024}KB: "
+                  f"scrape fails and is negatively cached (bs4 got {len(expected)} chars)")
+            continue
+        if text != expected:
+            print(f"{name[:27]:<28}{len(content) / 1024:>8.0f}KB  ❌ extracted text differs from bs4 "
+                  f"({len(text)} vs {len(expected)} chars)")
+            mismatches += 1
+            continue
+        totals[0] += legacy_s
+        totals[1] += stream_s
+        totals[2] = max(totals[2], legacy_peak)
+        totals[3] = max(totals[3], stream_peak)
+        print(f"{name[:27]:<28}{len(content) / 1024:>8.0f}KB{legacy_s * 1000:>10.1f}{legacy_peak / 1e6:>9.1f}MB"
+              f"{stream_s * 1000:>11.1f}{stream_peak / 1e6:>11.1f}MB{min(consumed[0], len(content)) / 1024:>8.0f}KB")
+    print(f"{'total / max peak':<38}{totals[0] * 1000:>10.1f}{totals[2] / 1e6:>9.1f}MB"
+          f"{totals[1] * 1000:>11.1f}{totals[3] / 1e6:>11.1f}MB")
+    if mismatches:
+        print(f"❌ {mismatches} page(s) extracted differently from the bs4 path")
+        return 1
+
+
+class StubLLM:
+    """Offline stand-in for Gemini: answers shortlist prompts with the first ids it was shown and
+    digest prompts with canned items, after an optional simulated latency. Callable as an `llm`,
+    or usable as a bot.LLMClient backend, where `slow_rate` of the calls take `slow_latency` instead
+    and models in `rate_limited` answer 429 with `retry_after`."""
+
+    def __init__(self, latency=0.0, slow_rate=0.0, slow_latency=0.0, rate_limited=(), retry_after=None, seed=0):
+        self.latency = latency
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.rate_limited = set(rate_limited)
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.models = defaultdict(int)
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, prompt):
+        with self.lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            with self.lock:
+                slow = self.rng.random() < self.slow_rate
+            time.sleep(self.slow_latency if slow else self.latency)
+            ids = [int(m) for m in re.findall(r'^\s*(\d+)\|', prompt, re.MULTILINE)]
+            if '"ids"' in prompt:
+                return json.dumps({"ids": ids[:bot.SHORTLIST_PER_SHARD]})
+            return json.dumps({"items": [{"type": "📄", "title": f"Stub pick {i}", "summary": "Canned summary.",
+                                          "source": "Stub", "id": i} for i in ids[:8]]})
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def generate(self, prompt, model, temperature):
+        with self.lock:
+            self.models[model] += 1
+        if model in self.rate_limited:
+            raise bot.LLMRateLimitError(f"{model}: 429 RESOURCE_EXHAUSTED", self.retry_after)
+        return self(prompt)
+
+
+def synthetic_candidates(n, seed=0):
+    """NewsItems shaped like fetch_all_news output, spread over the last 24 hours."""
+    rng = random.Random(seed)
+    words = ("model agent launch funding chip open weights policy startup benchmark reasoning "
+             "robotics cloud security privacy search browser phone quantum").split()
+    now = time.time()
+    items = []
+    for i in range(n):
+        title = " ".join(rng.choice(words) for _ in range(8)).capitalize() + f" {i}"
+        items.append(bot.NewsItem(
+            title=title,
+            summary=" ".join(rng.choice(words) for _ in range(120)),
+            source=f"Source {i % 40}",
+            url=f"https://news{i % 40}.example.com/story/{i}",
+            published_ts=now - rng.uniform(0, 86000),
+            type=rng.choice(["news", "research"]),
+            weight=rng.choice([0.7, 1.0, 1.2]),
+        ))
+    return items
+
+
+def _synthetic_feed_entries(feeds, entries, seed=0):
+    """feedparser-style entries for `feeds` newest-first feeds of `entries` items over the past week,
+    with RFC-822 dates on most feeds and ISO-8601 on the rest (as real feeds mix them)."""
+    rng = random.Random(seed)
+    now = time.time()
+    result = []
+    for f in range(feeds):
+        iso = f % 5 == 0
+        ts = now - rng.uniform(0, 3600)
+        feed = []
+        for e in range(entries):
+            parsed = time.gmtime(ts)
+            published = (time.strftime('%Y-%m-%dT%H:%M:%SZ', parsed) if iso
+                         else time.strftime('%a, %d %b %Y %H:%M:%S +0000', parsed))
+            feed.append({"title": f"Story {f}-{e}", "link": f"https://feed{f}.example.com/{e}",
+                         "summary": "Summary text " * 10, "published": published, "published_parsed": parsed})
+            ts -= rng.uniform(0, 7 * 86400 * 2 / entries)
+        result.append(feed)
+    return result
+
+
+def _legacy_within_24_hours(published_date_str):
+    """The pre-NewsItem check: a dateutil parse per entry."""
+    from datetime import datetime, timedelta
+    try:
+        pub_date = bot.parse_date(published_date_str)
+        if pub_date.tzinfo is None:
+            pub_date = bot.pytz.utc.localize(pub_date)
+        return (datetime.now(bot.pytz.utc) - pub_date) < timedelta(hours=24)
+    except Exception:
+        return True
+
+
+def bench_freshness(args):
+    """Freshness filtering and ordering over a large feed set: per-entry dateutil parsing, dict items
+    and a sort on the raw date string vs parsed epochs, one cutoff, early exit and NewsItem."""
+    feeds = _synthetic_feed_entries(args.feeds, args.entries)
+    total = sum(len(f) for f in feeds)
+
+    def legacy_item(entry):
+        return {"title": entry["title"], "summary": entry["summary"], "source": "Synthetic", "url": entry["link"],
+                "published_at": entry["published"], "type": "news", "deep_fetch": True, "weight": 1.0}
+
+    def legacy():
+        items = [legacy_item(entry) for feed in feeds for entry in feed
+                 if not entry["published"] or _legacy_within_24_hours(entry["published"])]
+        return sorted(items, key=lambda i: i["published_at"], reverse=True)
+
+    def current():
+        cutoff = bot.freshness_cutoff()
+        items = []
+        for feed in feeds:
+            records = [bot._entry_record(entry) for entry in feed]
+            for entry, ts in bot.fresh_entries(records, cutoff, len(records)):
+                items.append(bot.NewsItem(entry["title"], entry["summary"], "Synthetic", entry["link"], ts, "news"))
+        return sorted(items, key=lambda i: i.published_ts, reverse=True)
+
+    legacy_s, old = _timed(legacy, repeat=1)
+    current_s, new = _timed(current, repeat=1)
+    epoch = {e["link"]: calendar.timegm(e["published_parsed"]) for feed in feeds for e in feed}
+    true_order = sorted(old, key=lambda i: epoch[i["url"]], reverse=True)
+    misplaced = sum(1 for a, b in zip(old, true_order) if a is not b)
+    fresh = {i.url for i in new}
+    _, dict_peak, _ = _measure(lambda: [legacy_item(e) for feed in feeds for e in feed if e["link"] in fresh])
+    _, item_peak, _ = _measure(lambda: [bot.NewsItem(e["title"], e["summary"], "Synthetic", e["link"], 0.0, "news")
+                                        for feed in feeds for e in feed if e["link"] in fresh])
+
+    # Counts can differ by an entry or two published right at the 24h boundary between the two passes
+    print(f"entries:                 {total:,} in {args.feeds} feeds ({len(old):,} / {len(new):,} fresh)")
+    print(f"dateutil + dict items:   {legacy_s * 1000:9.1f} ms  ({misplaced:,} items out of place after the string sort)")
+    print(f"epochs + NewsItem:       {current_s * 1000:9.1f} ms  (one cutoff, early exit per newest-first feed)")
+    print(f"speed-up:                {legacy_s / current_s:9.1f}x")
+    print(f"item memory (fresh set): dicts {dict_peak / 1e6:.2f} MB vs NewsItem {item_peak / 1e6:.2f} MB")
+
+
+def bench_mapreduce(args):
+    """Digest generation over a large candidate pool against a stub LLM (no network)."""
+    _fresh_db(tempfile.mkdtemp(), "bench_mapreduce")
+    items = bot.rank_candidates(synthetic_candidates(args.candidates), 'all')
+    llm = StubLLM(latency=args.latency)
+    start = time.perf_counter()
+    digest = bot.generate_digest(items, 'all', llm=llm)
+    elapsed = time.perf_counter() - start
+    print(f"candidates:        {len(items):,}")
+    print(f"LLM calls:         {llm.calls} (max {llm.max_in_flight} in flight, limit {bot.LLM_CONCURRENCY})")
+    print(f"digest items:      {len(digest['items']) if digest else 0}")
+    print(f"wall time:         {elapsed:.2f}s at {args.latency:.2f}s simulated latency per call")
+
+
+def bench_llm(args):
+    """LLMClient tail latency with and without hedging against a stub backend with a slow tail,
+    then model fallback when the primary model is out of quota (no network)."""
+    prompt = "\n".join(f"{i}|Stub title {i}" for i in range(20))
+    for hedge_after in (0, args.hedge_after):
+        bot.TRACE.reset('bench')
+        backend = StubLLM(latency=args.latency, slow_rate=args.slow_rate, slow_latency=args.slow_latency)
+        client = bot.LLMClient(backend, models=['primary'], hedge_after=hedge_after, cache=False)
+        latencies = []
+        for _ in range(args.calls):
+            start = time.perf_counter()
+            client(prompt)
+            latencies.append(time.perf_counter() - start)
+        counters = bot.TRACE.report()['counters']
+        label = f"hedge after {hedge_after:g}s" if hedge_after else "no hedging"
+        print(f"{label:18} p50 {bot.percentile(latencies, 0.5):6.2f}s  p95 {bot.percentile(latencies, 0.95):6.2f}s  "
+              f"max {max(latencies):6.2f}s  backend calls {backend.calls} "
+              f"(hedged {counters.get('llm.hedged', 0):g}, hedge wins {counters.get('llm.hedge_wins', 0):g})")
+
+    bot.TRACE.reset('bench')
+    backend = StubLLM(latency=args.latency, rate_limited={'primary'}, retry_after=3600)
+    client = bot.LLMClient(backend, models=['primary', 'fallback'], hedge_after=0, cache=False)
+    start = time.perf_counter()
+    ok = client(prompt) is not None
+    elapsed = time.perf_counter() - start
+    print(f"quota exhausted:   answered={ok} in {elapsed:.2f}s, calls per model {dict(backend.models)}, "
+          f"fallbacks {bot.TRACE.report()['counters'].get('llm.fallbacks', 0):g}")
+
+
+class MockGraphAPI(ThreadingHTTPServer):
+    """Local stand-in for the WhatsApp Cloud API messages endpoint.
+    Accepts at most `limit` messages per rolling second (excess gets error 130429), and answers
+    text messages to numbers ending in `closed_suffix` with 131047 (session window closed)."""
+
+    def __init__(self, port=0, limit=25, closed_suffix="7", latency=0.02):
+        super().__init__(("127.0.0.1", port), _MockGraphHandler)
+        self.limit = limit
+        self.closed_suffix = closed_suffix
+        self.latency = latency
+        self.window = deque()
+        self.lock = threading.Lock()
+        self.stats = {"accepted": 0, "throttled": 0, "window_closed": 0}
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v22.0"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _MockGraphHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        server = self.server
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        time.sleep(server.latency)
+        with server.lock:
+            now = time.monotonic()
+            while server.window and now - server.window[0] > 1.0:
+                server.window.popleft()
+            if len(server.window) >= server.limit:
+                server.stats["throttled"] += 1
+                return self._reply(400, {"error": {"code": 130429, "message": "Rate limit hit"}})
+            server.window.append(now)
+            if payload.get("type") == "text" and str(payload.get("to", "")).endswith(server.closed_suffix):
+                server.stats["window_closed"] += 1
+                return self._reply(400, {"error": {"code": 131047, "message": "Re-engagement message"}})
+            server.stats["accepted"] += 1
+        self._reply(200, {"messages": [{"id": f"wamid.{random.getrandbits(48):x}"}]})
+
+
+def bench_broadcast(args):
+    """WhatsApp broadcast throughput and throttling against the mock Graph API (no calls to Meta)."""
+    tmp = tempfile.mkdtemp()
+    bot.DB_FILE = os.path.join(tmp, "bench_broadcast.db")
+    bot.SEEN_STATE_DIR = os.path.join(tmp, "seen_state")
+    bot.init_db()
+    mock = MockGraphAPI(limit=args.limit).start()
+    bot.WHATSAPP_GRAPH_URL = mock.base_url
+    bot.WHATSAPP_TOKEN, bot.WHATSAPP_PHONE_ID = "bench-token", "1234"
+    bot.WA_BROADCAST_RATE = args.rate
+    bot.DELIVERY_BACKOFF = 0.5
+    os.environ["WHATSAPP_TEMPLATE_NAME"] = "daily_digest"
+    bot.add_recipients([f"9199{i:08d}" for i in range(args.recipients)])
+
+    message = "\n\n".join(f"{i}. 📄 *Headline {i}*\n" + "summary words " * 20 for i in range(8))
+    start = time.perf_counter()
+    bot.broadcast_whatsapp(message, "bench")
+    elapsed = time.perf_counter() - start
+    conn = bot.get_db()
+    statuses = dict(conn.execute("SELECT status, COUNT(*) FROM wa_deliveries GROUP BY status").fetchall())
+    switched = conn.execute("SELECT COUNT(*) FROM wa_recipients WHERE mode = 'template'").fetchone()[0]
+    print(f"recipients:        {args.recipients:,}")
+    print(f"deliveries:        {statuses}")
+    print(f"switched to template mode: {switched}")
+    print(f"mock API:          {mock.stats} (limit {args.limit}/s)")
+    print(f"throughput:        {mock.stats['accepted'] / elapsed:.1f} msg/s (bucket {args.rate}/s) in {elapsed:.1f}s")
+    mock.shutdown()
+    bot.close_db()
+
+
+def run_mock_graph(args):
+    mock = MockGraphAPI(port=args.port, limit=args.limit)
+    print(f"Mock Graph API on {mock.base_url} (limit {args.limit}/s, 131047 for numbers ending in {mock.closed_suffix})")
+    try:
+        mock.serve_forever()
+    except KeyboardInterrupt:
+        print(mock.stats)
+
+
+# --- job() record / replay ---
+# A fixture directory holds meta.json (capture time, LLM kind), sources.json (the SOURCES registry
+# at capture time), http.jsonl (one response per line) and llm.jsonl (Gemini responses).
+# Credentials are redacted from recorded URLs and headers, and replays run with placeholder ones.
+
+JOB_MODES = ("all", "news", "research")
+JOB_STAGES = ("fetch_all_news", "load_candidate_pool", "fetch_feeds", "fetch_reddit_listing", "cluster_stories",
+              "fill_deep_content", "rank_candidates", "generate_digest", "shortlist_candidates",
+              "encode_candidates", "build_digest_prompt", "deliver_digest")
+BENCH_SECRETS = {"BOT_TOKEN": "bench-bot-token", "GEMINI_API_KEY": "bench-gemini-key",
+                 "WHATSAPP_TOKEN": "bench-wa-token", "WHATSAPP_PHONE_ID": "bench-wa-phone-id"}
+BENCH_CONFIG = dict(BENCH_SECRETS, CHAT_ID="-100123", WHATSAPP_RECIPIENT="919800000000")
+
+
+def _redact(url):
+    for name in BENCH_SECRETS:
+        value = getattr(bot, name, None)
+        if value and len(value) >= 8:
+            url = url.replace(value, f"<{name}>")
+    return url
+
+
+def _make_response(url, status, headers, body):
+    """A real requests.Response over an in-memory body (iter_content/json/text all work)."""
+    r = requests.Response()
+    r.url, r.status_code, r._content, r._content_consumed = url, status, body, True
+    r.headers = requests.structures.CaseInsensitiveDict(headers)
+    return r
+
+
+def _delivery_reply(url):
+    """Canned success replies for the delivery APIs (used when recording without --deliver)."""
+    if "api.telegram.org" in url:
+        return {"ok": True, "result": {"message_id": 1}}
+    return {"messages": [{"id": "wamid.bench"}]}
+
+
+class TrafficStats:
+    """Per-session request counts and bytes (request and response), plus LLM calls."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = defaultdict(int)
+        self.bytes_in = defaultdict(int)
+        self.bytes_out = defaultdict(int)
+        self.misses = 0
+
+    def add(self, name, sent, received):
+        with self.lock:
+            self.requests[name] += 1
+            self.bytes_out[name] += sent
+            self.bytes_in[name] += received
+
+
+def _request_size(kwargs):
+    if kwargs.get("json") is not None:
+        return len(json.dumps(kwargs["json"]))
+    return len(kwargs.get("data") or b"")
+
+
+class RecordingSession(requests.Session):
+    """A live session that appends every response to the fixture log. Delivery APIs get canned
+    replies instead of real sends unless `deliver` is set."""
+
+    def __init__(self, name, log, stats, deliver=False):
+        super().__init__()
+        self.name, self.log, self.stats, self.deliver = name, log, stats, deliver
+
+    def request(self, method, url, **kwargs):
+        if self.name in ("telegram", "whatsapp") and not self.deliver:
+            body = json.dumps(_delivery_reply(url)).encode()
+            r = _make_response(url, 200, {"Content-Type": "application/json"}, body)
+        else:
+            r = super().request(method, url, **kwargs)
+            r.content  # read streamed bodies fully so they can be stored
+        self.stats.add(self.name, _request_size(kwargs), len(r.content))
+        headers = {k: v for k, v in r.headers.items() if k.lower() not in ("set-cookie", "authorization")}
+        self.log.write(json.dumps({"session": self.name, "method": method.upper(), "url": _redact(url),
+                                   "status": r.status_code, "headers": headers,
+                                   "body": base64.b64encode(r.content).decode()}) + "\n")
+        return r
+
+
+class ReplaySession:
+    """Serves recorded responses by (method, redacted URL). Repeated requests get the recorded
+    responses in order, then the last one again; unknown URLs get a 404 and count as misses."""
+
+    def __init__(self, name, fixtures, stats):
+        self.name, self.fixtures, self.stats = name, fixtures, stats
+
+    def request(self, method, url, **kwargs):
+        queue = self.fixtures.get((method.upper(), _redact(url)))
+        if not queue:
+            with self.stats.lock:
+                self.stats.misses += 1
+            r = _make_response(url, 404, {}, b"")
+        else:
+            rec = queue.pop(0) if len(queue) > 1 else queue[0]
+            r = _make_response(url, rec["status"], rec["headers"], base64.b64decode(rec["body"]))
+        self.stats.add(self.name, _request_size(kwargs), len(r.content))
+        return r
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+class StageTimer:
+    """Wraps bot functions by name and accumulates inclusive wall time and call counts."""
+
+    def __init__(self, names):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.lock = threading.Lock()
+        self.originals = {name: getattr(bot, name) for name in names}
+        for name, fn in self.originals.items():
+            setattr(bot, name, self._wrap(name, fn))
+
+    def _wrap(self, name, fn):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.seconds[name] += time.perf_counter() - start
+                    self.calls[name] += 1
+        return timed
+
+    def restore(self):
+        for name, fn in self.originals.items():
+            setattr(bot, name, fn)
+
+
+def _fresh_db(tmp, label):
+    bot.close_db()
+    bot.DB_FILE = os.path.join(tmp, f"{label}.db")
+    bot.SEEN_STATE_DIR = os.path.join(tmp, f"{label}_seen_state")
+    bot.init_db()
+
+
+def _prompt_key(prompt):
+    # The prompt embeds today's date; drop it so fixtures replay on any day
+    return hashlib.sha256(re.sub(r"\b[A-Z][a-z]+ \d{2}, \d{4}\b", "<date>", prompt).encode()).hexdigest()
+
+
+def record_fixtures(args):
+    """Runs job() once against the live network and Gemini, storing every response as fixtures."""
+    os.makedirs(args.dir, exist_ok=True)
+    stats = TrafficStats()
+    tmp = tempfile.mkdtemp()
+    _fresh_db(tmp, "record")
+    with open(os.path.join(args.dir, "sources.json"), "w") as f:
+        json.dump(bot.SOURCES, f, indent=1)
+    with open(os.path.join(args.dir, "meta.json"), "w") as f:
+        json.dump({"recorded_at": time.time(), "llm": "recorded", "mode": args.mode}, f)
+
+    log = open(os.path.join(args.dir, "http.jsonl"), "w")
+    llm_log = open(os.path.join(args.dir, "llm.jsonl"), "w")
+    sessions = {}
+    bot.http_session = lambda name: sessions.setdefault(name, RecordingSession(name, log, stats, args.deliver))
+    live_generate = bot.gemini_generate
+
+    def recording_generate(prompt):
+        text = live_generate(prompt)
+        llm_log.write(json.dumps({"key": _prompt_key(prompt), "response": text}) + "\n")
+        return text
+
+    bot.gemini_generate = recording_generate
+    try:
+        bot.job(args.mode)
+        # Each mode asks Reddit for its own combined listing; capture the other modes' too so replay covers them
+        for mode in JOB_MODES:
+            reddit = bot.sources_for(mode, 'reddit')
+            if mode != args.mode and reddit:
+                try:
+                    bot.fetch_reddit_listing(reddit)
+                except Exception as e:
+                    print(f"⚠️ Could not record the {mode} Reddit listing: {e}")
+    finally:
+        log.close()
+        llm_log.close()
+    print(f"recorded {sum(stats.requests.values())} responses ({sum(stats.bytes_in.values()) / 1e6:.1f} MB) into {args.dir}")
+
+
+class _ReplayLLM:
+    """Answers prompts from llm.jsonl by prompt key, falling back to recorded order (or StubLLM)."""
+
+    def __init__(self, records, stub):
+        self.by_key = {r["key"]: r["response"] for r in records}
+        self.in_order = [r["response"] for r in records]
+        self.stub = stub
+        self.calls = self.prompt_chars = self.response_chars = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, prompt):
+        with self.lock:
+            self.calls += 1
+            text = self.by_key.get(_prompt_key(prompt))
+            if text is None and self.in_order and not self.stub:
+                text = self.in_order[min(self.calls - 1, len(self.in_order) - 1)]
+        if text is None:
+            text = self.stub(prompt)
+        with self.lock:
+            self.prompt_chars += len(prompt)
+            self.response_chars += len(text or "")
+        return text
+
+
+def _load_fixtures(directory):
+    with open(os.path.join(directory, "meta.json")) as f:
+        meta = json.load(f)
+    with open(os.path.join(directory, "sources.json")) as f:
+        sources = json.load(f)
+    fixtures = defaultdict(list)
+    with open(os.path.join(directory, "http.jsonl")) as f:
+        for line in f:
+            rec = json.loads(line)
+            fixtures[(rec["method"], rec["url"])].append(rec)
+    llm_records = []
+    if os.path.exists(os.path.join(directory, "llm.jsonl")):
+        with open(os.path.join(directory, "llm.jsonl")) as f:
+            llm_records = [json.loads(line) for line in f]
+    return meta, sources, fixtures, llm_records
+
+
+def _replay_clock(recorded_at):
+    """freshness_cutoff as seen at capture time, so old fixtures keep the same freshness window."""
+    return lambda: recorded_at - bot.FRESHNESS_WINDOW_HOURS * 3600
+
+
+def replay_job(directory, mode, memory=False):
+    """One offline job(mode) over the fixtures; returns (wall_s, peak_bytes, StageTimer, TrafficStats, llm)."""
+    meta, sources, fixtures, llm_records = _load_fixtures(directory)
+    stats = TrafficStats()
+    llm = _ReplayLLM(llm_records, StubLLM() if meta.get("llm") == "stub" else None)
+    for name, value in BENCH_CONFIG.items():
+        setattr(bot, name, value)
+    bot.SOURCES = sources
+    bot.TELEGRAM_MIN_INTERVAL = bot.WHATSAPP_MIN_INTERVAL = 0
+    bot.host_limiter = bot.HostRateLimiter()
+    bot.freshness_cutoff = _replay_clock(meta["recorded_at"])
+    sessions = {}
+    bot.http_session = lambda name: sessions.setdefault(name, ReplaySession(name, fixtures, stats))
+    bot.gemini_generate = llm
+    _fresh_db(tempfile.mkdtemp(), f"replay-{mode}")
+
+    timer = StageTimer(JOB_STAGES)
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        bot.job(mode)
+    finally:
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if memory else 0
+        if memory:
+            tracemalloc.stop()
+        timer.restore()
+    return elapsed, peak, timer, stats, llm
+
+
+def bench_replay(args):
+    """Replays job() for each mode against recorded or synthetic fixtures, fully offline."""
+    originals = {name: getattr(bot, name) for name in
+                 ("SOURCES", "http_session", "gemini_generate", "freshness_cutoff", "host_limiter",
+                  "TELEGRAM_MIN_INTERVAL", "WHATSAPP_MIN_INTERVAL", *BENCH_CONFIG)}
+    reports = []
+    for mode in args.modes:
+        for name, value in originals.items():
+            setattr(bot, name, value)
+        elapsed, _, timer, stats, llm = replay_job(args.dir, mode)
+        peak = replay_job(args.dir, mode, memory=True)[1] if args.memory else 0
+        reports.append((mode, elapsed, peak, timer, stats, llm))
+
+    for mode, elapsed, peak, timer, stats, llm in reports:
+        print(f"\n=== job('{mode}') — {elapsed:.2f}s wall" + (f", peak {peak / 1e6:.1f} MB traced" if peak else ""))
+        print(f"{'stage':<24}{'calls':>7}{'seconds':>10}")
+        for name in JOB_STAGES:
+            if timer.calls[name]:
+                print(f"{name:<24}{timer.calls[name]:>7}{timer.seconds[name]:>10.3f}")
+        for name in sorted(stats.requests):
+            print(f"http[{name}]".ljust(24) + f"{stats.requests[name]:>7} req  "
+                  f"{stats.bytes_out[name] / 1e3:.1f} KB out  {stats.bytes_in[name] / 1e6:.2f} MB in")
+        print(f"{'llm':<24}{llm.calls:>7} call  {llm.prompt_chars / 1e3:.1f}k prompt chars  "
+              f"{llm.response_chars / 1e3:.1f}k response chars")
+        if stats.misses:
+            print(f"⚠️ {stats.misses} request(s) had no fixture (served as 404)")
+    bot.close_db()
+
+
+def synth_fixtures(args):
+    """Writes scaled synthetic fixtures: `feeds` RSS sources with `entries` items each (a share of
+    them cross-posted between feeds, a share with teaser summaries that need a deep fetch), the
+    combined Reddit listing each mode requests, and canned delivery replies. Digests come from StubLLM on replay."""
+    rng = random.Random(args.seed)
+    os.makedirs(args.dir, exist_ok=True)
+    now = time.time()
+    words = ("model agent launch funding chip open weights policy startup benchmark reasoning "
+             "robotics cloud security privacy search browser phone quantum").split()
+    stories = [" ".join(rng.choice(words) for _ in range(7)).capitalize() + f" {i}"
+               for i in range(args.feeds * args.entries)]
+    sources = [{"name": f"Synthetic {i}", "kind": "rss", "url": f"https://feed{i}.example.com/rss",
+                "type": "research" if i % 3 == 0 else "news", "max_entries": args.entries} for i in range(args.feeds)]
+    sources += [{"name": f"r/synthetic{i}", "kind": "reddit", "subreddit": f"synthetic{i}",
+                 "type": "research" if i % 2 else "news", "max_entries": 15} for i in range(5)]
+
+    def record(url, body, content_type="application/rss+xml", method="GET"):
+        return json.dumps({"session": "ingest", "method": method, "url": url, "status": 200,
+                           "headers": {"Content-Type": content_type}, "body": base64.b64encode(body).decode()}) + "\n"
+
+    pages = 0
+    with open(os.path.join(args.dir, "http.jsonl"), "w") as log:
+        for i, src in enumerate(sources[:args.feeds]):
+            items = []
+            for j in range(args.entries):
+                # ~10% of entries re-post a story from another feed under its own URL
+                k = rng.randrange(len(stories)) if rng.random() < 0.1 else i * args.entries + j
+                link = f"https://feed{i}.example.com/story/{j}"
+                teaser = rng.random() < args.teaser_share
+                summary = "Read more..." if teaser else " ".join(rng.choice(words) for _ in range(60))
+                items.append(f"<item><title>{stories[k]}</title><link>{link}</link>"
+                             f"<pubDate>{formatdate(now - rng.uniform(0, 30 * 3600), usegmt=True)}</pubDate>"
+                             f"<description>{summary}</description></item>")
+                if teaser:
+                    log.write(record(link, _synthetic_page(12, 4, seed=j), "text/html; charset=utf-8"))
+                    pages += 1
+            log.write(record(src["url"], (f"<?xml version='1.0'?><rss version='2.0'><channel><title>{src['name']}</title>"
+                                          + "".join(items) + "</channel></rss>").encode()))
+        posts = {src["subreddit"]: [{"data": {"title": stories[rng.randrange(len(stories))], "subreddit": src["subreddit"],
+                                              "permalink": f"/r/{src['subreddit']}/comments/{n}/x/",
+                                              "created_utc": now - 3600, "is_self": True,
+                                              "selftext": " ".join(rng.choice(words) for _ in range(80))}}
+                                    for n in range(15)]
+                 for src in sources[args.feeds:]}
+        live_sources, bot.SOURCES = bot.SOURCES, sources
+        try:
+            listings = {mode: bot.sources_for(mode, 'reddit') for mode in JOB_MODES}
+        finally:
+            bot.SOURCES = live_sources
+        for reddit in listings.values():
+            children = [post for src in reddit for post in posts[src["subreddit"]]]
+            log.write(record(bot.reddit_listing_url(reddit), json.dumps({"data": {"children": children}}).encode(),
+                             "application/json"))
+        for url in ("https://api.telegram.org/bot<BOT_TOKEN>/sendMessage",
+                    f"{bot.WHATSAPP_GRAPH_URL}/<WHATSAPP_PHONE_ID>/messages"):
+            log.write(json.dumps({"session": "delivery", "method": "POST", "url": url, "status": 200,
+                                  "headers": {"Content-Type": "application/json"},
+                                  "body": base64.b64encode(json.dumps(_delivery_reply(url)).encode()).decode()}) + "\n")
+    with open(os.path.join(args.dir, "sources.json"), "w") as f:
+        json.dump(sources, f, indent=1)
+    with open(os.path.join(args.dir, "meta.json"), "w") as f:
+        json.dump({"recorded_at": now, "llm": "stub", "feeds": args.feeds, "entries": args.entries}, f)
+    print(f"wrote {args.feeds} feeds x {args.entries} entries, {pages} article pages, {len(listings)} Reddit listings to {args.dir}")
+
+
+# Child process for the startup benchmark: runs bot.py as a script and exits at its first HTTP request.
+_FIRST_REQUEST_PROBE = """
+import os, sys, time, runpy, requests
+def first_request(self, method, url, *args, **kwargs):
+    sys.stderr.write(f"FIRST_REQUEST {time.time()!r} {method} {url}\\n")
+    sys.stderr.flush()
+    os._exit(0)
+requests.Session.request = first_request
+sys.argv = [SCRIPT] + ARGV
+runpy.run_path(SCRIPT, run_name="__main__")
+"""
+HEAVY_IMPORTS = ("google.genai", "bs4", "feedparser", "dateutil", "schedule")
+
+
+def _startup_once(argv):
+    """(ms to first request, first request line, {module: cumulative import us}) for one cold start."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+    code = f"SCRIPT = {script!r}\nARGV = {argv!r}\n" + _FIRST_REQUEST_PROBE
+    env = {k: v for k, v in os.environ.items() if k not in ("GITHUB_ACTIONS", "PYTHONPROFILEIMPORTTIME")}
+    start = time.time()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=tempfile.mkdtemp(),
+                          env=env, capture_output=True, text=True, timeout=120)
+    imports, first = {}, None
+    for line in proc.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+            if cumulative.isdigit():
+                imports[name] = int(cumulative)
+        elif line.startswith("FIRST_REQUEST"):
+            first = line.split(" ", 2)
+    if first is None:
+        raise RuntimeError(f"bot.py exited without a network request:\n{proc.stdout[-500:]}{proc.stderr[-500:]}")
+    return (float(first[1]) - start) * 1000, first[2], imports
+
+
+def bench_startup(args):
+    """Wall time from `python bot.py <args>` to its first network request, with -X importtime detail."""
+    argv = args.bot_args or ["--mode", "news"]
+    runs = [_startup_once(argv) for _ in range(args.runs)]
+    times = [ms for ms, _, _ in runs]
+    _, request, imports = runs[-1]
+    top = sorted(((us, name) for name, us in imports.items() if "." not in name), reverse=True)[:8]
+    print(f"command:           python bot.py {' '.join(argv)}")
+    print(f"first request:     {request}")
+    print(f"to first request:  median {statistics.median(times):.0f} ms (min {min(times):.0f}, max {max(times):.0f}, {args.runs} runs)")
+    print("slowest package imports (cumulative):")
+    for us, name in top:
+        print(f"  {name:<24}{us / 1000:>8.1f} ms")
+    loaded = [name for name in HEAVY_IMPORTS if name in imports]
+    print(f"heavy deps loaded before first request: {', '.join(loaded) or 'none'}")
+    if args.max_ms and statistics.median(times) > args.max_ms:
+        print(f"❌ Startup regression: median above {args.max_ms:.0f} ms")
+        return 1
+
+
+ARCHIVE_ENTITIES = ("Llama", "Gemini", "Claude", "Mistral", "Qwen", "DeepSeek", "GPT", "Sora", "Grok", "Phi")
+
+
+def synthetic_archive(years, per_day, seed=0):
+    """Fills the digest archive with `years` of daily digests (two modes, `per_day` items a day)."""
+    rng = random.Random(seed)
+    words = ("model agent launch funding chip open weights policy startup benchmark reasoning "
+             "robotics cloud security privacy search browser phone quantum").split()
+    now = time.time()
+    total = 0
+    for day in range(int(years * 365), 0, -1):
+        sent_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now - day * 86400))
+        for mode in ('research', 'news'):
+            items = []
+            for i in range(per_day // 2):
+                entity = "Zephyr" if rng.random() < 0.001 else rng.choice(ARCHIVE_ENTITIES)  # a rare term
+                title = f"{entity} " + " ".join(rng.choice(words) for _ in range(6))
+                items.append({"type": "📄", "title": title, "headline": title,
+                              "summary": " ".join(rng.choice(words) for _ in range(40)),
+                              "source": f"Source {i % 40}", "url": f"https://example.com/{day}/{mode}/{i}",
+                              "fingerprint": rng.getrandbits(64)})
+            total += bot.archive_digest({"digest_id": f"{day}-{mode}", "items": items}, mode, sent_at=sent_at)
+    return total
+
+
+def bench_archive(args):
+    """Digest archive queries (FTS5 + sent_at range) on a synthetic multi-year archive, against a
+    LIKE scan, plus archive-backed dedup of one run's top candidates."""
+    _fresh_db(tempfile.mkdtemp(), "bench_archive")
+    fill_s, total = _timed(lambda: synthetic_archive(args.years, args.per_day), repeat=1)
+    month = time.strftime('%Y-%m', time.gmtime(time.time() - 400 * 86400))
+    conn = bot.get_db()
+
+    def like_scan(term, since="0000-01-01", until="9999-12-31"):
+        return conn.execute("SELECT sent_at, title FROM digest_items WHERE (title LIKE ? OR summary LIKE ?) "
+                            "AND sent_at >= ? AND sent_at < ? ORDER BY sent_at DESC LIMIT ?",
+                            (f"%{term}%", f"%{term}%", since, until, args.limit)).fetchall()
+
+    print(f"archive:                    {total:,} items over {args.years:g} years "
+          f"(filled in {fill_s:.1f}s, {os.path.getsize(bot.DB_FILE) / 1e6:.1f} MB)")
+    queries = [("'llama', all time", lambda: bot.search_archive("llama", limit=args.limit)),
+               (f"'llama' in {month}", lambda: bot.search_archive("llama", month, month, limit=args.limit)),
+               (f"'open weights' in {month[:4]}", lambda: bot.search_archive("open weights", month[:4], month[:4], limit=args.limit)),
+               (f"everything in {month}", lambda: bot.search_archive(None, month, month, limit=args.limit)),
+               ("'zephyr' (rare), all time", lambda: bot.search_archive("zephyr", limit=args.limit)),
+               ("LIKE 'llama', all time", lambda: like_scan("llama")),
+               (f"LIKE 'llama' in {month}", lambda: like_scan("llama", bot.date_bound(month), bot.date_bound(month, end=True))),
+               ("LIKE 'zephyr', all time", lambda: like_scan("zephyr"))]
+    for label, fn in queries:
+        elapsed, rows = _timed(fn)
+        print(f"{label:28}{elapsed * 1000:9.2f} ms ({len(rows)} rows)")
+
+    candidates = synthetic_candidates(args.candidates)
+    dedup_s, kept = _timed(lambda: bot.drop_archived_stories(candidates, limit=args.candidates), repeat=3)
+    print(f"archive dedup:              {dedup_s * 1000:9.2f} ms for {args.candidates} candidates "
+          f"({len(candidates) - len(kept)} dropped)")
+    bot.close_db()
+
+
+# --- Golden checks: digest rendering and chunking against the pre-IR formatters ---
+
+def _legacy_format(data, mode, telegram):
+    """format_telegram_digest / format_whatsapp_digest as they were before the digest IR."""
+    now = bot.datetime.now(bot.pytz.timezone('Asia/Kolkata'))
+    today_str = now.strftime("%B %d, %Y")
+    greeting = "🌅 *GM*" if now.hour < 12 else "☕ *Good Afternoon*"
+    topic_header = "🗞️ *TECH DIGEST*"
+    if mode == 'research': topic_header = "🔬 *RESEARCH & AI PAPERS*"
+    elif mode == 'news': topic_header = "📰 *TECH NEWS & UPDATES*"
+    esc = bot.escape_markdown_v2
+    msg = f"{greeting} — {topic_header}\n{esc(today_str) if telegram else today_str}\n\n"
+    items = data.get('items', [])
+    if not items:
+        msg += "_(No massive updates found at this time)_\n\n"
+    for i, item in enumerate(items):
+        url = item.get('url', '')
+        if not url.startswith('http'): url = 'https://google.com'
+        if telegram:
+            msg += (f"{i+1}\\. {esc(item.get('type', '🔹'))} *{esc(item.get('title', 'Untitled'))}*\n"
+                    f"{esc(item.get('summary', ''))}\n📎 [{esc(item.get('source', 'Source'))}]({url})\n\n")
+        else:
+            msg += (f"{i+1}. {item.get('type', '🔹')} *{item.get('title', 'Untitled').replace('*', '')}*\n"
+                    f"{item.get('summary', '')}\n📎 {item.get('source', 'Source')}: {url}\n\n")
+    msg += "━━━━━━━━━━━━━━━━━━━━\n🤖 _Tech News by VJ_"
+    return msg
+
+
+def _legacy_split(message, limit):
+    """The pre-IR split_message."""
+    if len(message) <= limit:
+        return [message]
+    messages, current_chunk = [], ""
+    for part in message.split('\n\n'):
+        if len(current_chunk) + len(part) + 2 > limit:
+            if current_chunk:
+                messages.append(current_chunk.strip())
+            current_chunk = part + "\n\n"
+        else:
+            current_chunk += part + "\n\n"
+    if current_chunk:
+        messages.append(current_chunk.strip())
+    return messages
+
+
+def golden_digests():
+    """Digests covering the formatting edge cases: none, markup characters, a full day, an item
+    longer than a message, and summaries containing blank lines."""
+    rng = random.Random(7)
+    words = "model agent launch funding chip open weights policy startup benchmark reasoning".split()
+
+    def item(i, summary_words=60, **extra):
+        return dict({"type": rng.choice(["📄", "🚀", "🔬"]), "title": f"Story {i}: " + " ".join(rng.sample(words, 5)),
+                     "summary": " ".join(rng.choice(words) for _ in range(summary_words)) + ".",
+                     "source": f"Source {i}", "url": f"https://example.com/{i}"}, **extra)
+
+    return {
+        "empty": {"items": []},
+        "markup": {"items": [item(0, title="GPT-5 (preview) *beats* [bench] v1.2!", source="r/Local_LLaMA"),
+                             item(1, url="not-a-url", summary="Costs $0.10 + tax = cheap_ish #ai ~ok | > `code`")]},
+        "full_day": {"items": [item(i) for i in range(12)]},
+        "oversize_item": {"items": [item(0), item(1, summary_words=900), item(2)]},
+        "blank_lines": {"items": [item(i, summary="First paragraph.\n\nSecond paragraph " + "word " * 150)
+                                  for i in range(6)]},
+    }
+
+
+def bench_golden(args):
+    """Digest IR renders and chunks vs the pre-IR formatters (exits non-zero on a regression)."""
+    limits = {"telegram": bot.TELEGRAM_MAX_CHARS, "whatsapp": bot.WHATSAPP_MAX_CHARS,
+              "template": bot.WHATSAPP_TEMPLATE_VAR_CHARS}
+    failures = 0
+    for name, data in golden_digests().items():
+        ir = bot.digest_ir(data, args.mode)
+        rendered = {"telegram": bot.render_digest(ir, "telegram"), "whatsapp": bot.render_digest(ir, "whatsapp")}
+        for channel, limit in limits.items():
+            blocks = rendered["telegram" if channel == "telegram" else "whatsapp"]
+            text = "\n\n".join(blocks)
+            legacy_text = _legacy_format(data, args.mode, channel == "telegram")
+            chunks = bot.chunk_blocks(blocks, limit)
+            legacy = _legacy_split(legacy_text, limit)
+            problems = []
+            if text != legacy_text:
+                problems.append("rendered text differs from the legacy format")
+            if any(len(c) > limit or not c.strip() for c in chunks):
+                problems.append("empty or oversize chunk")
+            if all(len(b) <= limit for b in blocks) and "\n\n".join(chunks) != text:
+                problems.append("chunks do not rejoin to the rendered text")
+            legacy_bad = [len(c) for c in legacy if len(c) > limit or not c.strip()]
+            note = f"legacy {len(legacy)} chunks" + (f", oversize/empty {legacy_bad}" if legacy_bad else "")
+            if chunks == legacy:
+                note += ", identical split"
+            status = "❌ " + "; ".join(problems) if problems else "✅"
+            print(f"{name:14} {channel:9} {len(chunks):2} chunks ≤ {limit} ({note}) {status}")
+            failures += bool(problems)
+        buttons = bot.share_buttons(rendered["whatsapp"])
+        too_long = [len(b[0]["url"]) for b in buttons if len(b[0]["url"]) > bot.WA_SHARE_URL_MAX]
+        decoded = "\n\n".join(bot.urllib.parse.unquote(b[0]["url"][len(bot.WA_SHARE_URL):]) for b in buttons)
+        ok = not too_long and (decoded == "\n\n".join(rendered["whatsapp"]) or name == "oversize_item")
+        print(f"{name:14} share     {len(buttons):2} buttons ≤ {bot.WA_SHARE_URL_MAX} URL chars "
+              f"(legacy 1 of {len(bot.WA_SHARE_URL + bot.urllib.parse.quote(_legacy_format(data, args.mode, False)))}) "
+              f"{'✅' if ok else '❌'}")
+        failures += not ok
+    if failures:
+        print(f"❌ {failures} golden check(s) failed")
+        return 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Tech News Bot micro-benchmarks')
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    p = sub.add_parser('seen', help='Seen-URL membership at 100k+ stored URLs')
+    p.add_argument('--stored', type=int, default=100_000)
+    p.add_argument('--candidates', type=int, default=1000)
+    p.set_defaults(func=bench_seen)
+
+    p = sub.add_parser('extract', help='Deep-article extraction time and peak memory')
+    p.add_argument('--corpus', help='Directory of saved .html pages (default: synthetic pages)')
+    p.set_defaults(func=bench_extract)
+
+    p = sub.add_parser('freshness', help='Freshness filtering and ordering over a synthetic 50k-entry feed set')
+    p.add_argument('--feeds', type=int, default=500)
+    p.add_argument('--entries', type=int, default=100)
+    p.set_defaults(func=bench_freshness)
+
+    p = sub.add_parser('mapreduce', help='Map-reduce digest generation against a stub LLM')
+    p.add_argument('--candidates', type=int, default=5000)
+    p.add_argument('--latency', type=float, default=0.5, help='Simulated seconds per LLM call')
+    p.set_defaults(func=bench_mapreduce)
+
+    p = sub.add_parser('llm', help='LLM client hedging and model fallback against a stub backend')
+    p.add_argument('--calls', type=int, default=40)
+    p.add_argument('--latency', type=float, default=0.2, help='Typical stub call latency (s)')
+    p.add_argument('--slow-rate', type=float, default=0.1, help='Share of calls that hit the slow tail')
+    p.add_argument('--slow-latency', type=float, default=3.0, help='Slow-tail call latency (s)')
+    p.add_argument('--hedge-after', type=float, default=0.5, help='Hedge delay to compare against no hedging (s)')
+    p.set_defaults(func=bench_llm)
+
+    p = sub.add_parser('broadcast', help='WhatsApp broadcast load test against a local mock Graph API')
+    p.add_argument('--recipients', type=int, default=500)
+    p.add_argument('--rate', type=float, default=20, help='Token-bucket rate (messages/second)')
+    p.add_argument('--limit', type=int, default=25, help='Mock API throughput limit (messages/second)')
+    p.set_defaults(func=bench_broadcast)
+
+    p = sub.add_parser('mock-graph', help='Run the mock WhatsApp Graph API server')
+    p.add_argument('--port', type=int, default=8089)
+    p.add_argument('--limit', type=int, default=25)
+    p.set_defaults(func=run_mock_graph)
+
+    p = sub.add_parser('record', help='Record job() fixtures from the live network and Gemini')
+    p.add_argument('dir')
+    p.add_argument('--mode', default='all', choices=['all', 'news', 'research'])
+    p.add_argument('--deliver', action='store_true', help='Really send to Telegram/WhatsApp while recording')
+    p.set_defaults(func=record_fixtures)
+
+    p = sub.add_parser('synth', help='Write scaled synthetic job() fixtures')
+    p.add_argument('dir')
+    p.add_argument('--feeds', type=int, default=200)
+    p.add_argument('--entries', type=int, default=50)
+    p.add_argument('--teaser-share', type=float, default=0.1, help='Share of entries that need a deep fetch')
+    p.add_argument('--seed', type=int, default=0)
+    p.set_defaults(func=synth_fixtures)
+
+    p = sub.add_parser('replay', help='Replay job() offline against fixtures with per-stage stats')
+    p.add_argument('dir')
+    p.add_argument('--modes', nargs='+', default=['research', 'news', 'all'], choices=['all', 'news', 'research'])
+    p.add_argument('--no-memory', dest='memory', action='store_false', help='Skip the tracemalloc pass')
+    p.set_defaults(func=bench_replay)
+
+    p = sub.add_parser('archive', help='Digest archive search and dedup on a synthetic multi-year archive')
+    p.add_argument('--years', type=float, default=3)
+    p.add_argument('--per-day', type=int, default=40, help='Archived items per day (split over two digests)')
+    p.add_argument('--limit', type=int, default=50)
+    p.add_argument('--candidates', type=int, default=150, help='Candidates checked by archive dedup')
+    p.set_defaults(func=bench_archive)
+
+    p = sub.add_parser('golden', help='Digest rendering/chunking golden checks against the pre-IR formatters')
+    p.add_argument('--mode', default='news', choices=['all', 'news', 'research'])
+    p.set_defaults(func=bench_golden)
+
+    p = sub.add_parser('startup', help='Cold start time to the first network request (-X importtime)')
+    p.add_argument('--runs', type=int, default=5)
+    p.add_argument('--max-ms', type=float, help='Exit non-zero when the median exceeds this (CI regression gate)')
+    p.add_argument('bot_args', nargs=argparse.REMAINDER, help='Arguments for bot.py (default: --mode news)')
+    p.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
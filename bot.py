@@ -1,20 +1,31 @@
 # -*- coding: utf-8 -*-
 import os
 import sys
+import atexit
 import time
+import calendar
 import json
 import re
 import random
+import codecs
+import hashlib
+from html.parser import HTMLParser
 import sqlite3
+import threading
+import urllib.parse
+import functools
+import contextvars
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 import requests
-import schedule
-import feedparser
 import pytz
-import google.genai as genai
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from datetime import datetime, timedelta
-from dateutil import parser as date_parser
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
+# google.genai, bs4, feedparser, dateutil and schedule are imported where they are first used:
+# together they are most of the startup time, and many runs never reach them.
 
 # Load environment variables
 load_dotenv()
@@ -29,33 +40,74 @@ WHATSAPP_TOKEN = os.getenv('WHATSAPP_ACCESS_TOKEN')
 WHATSAPP_PHONE_ID = os.getenv('WHATSAPP_PHONE_NUMBER_ID')
 WHATSAPP_RECIPIENT = os.getenv('WHATSAPP_RECIPIENT_PHONE_NUMBER')
 WHATSAPP_CHANNEL_URL = os.getenv('WHATSAPP_CHANNEL_URL', 'https://whatsapp.com/channel/0029Vb75sw08vd1GsBm3RD1Z')
+WHATSAPP_GRAPH_URL = os.getenv('WHATSAPP_GRAPH_URL', 'https://graph.facebook.com/v22.0')
+
+# WhatsApp broadcast: when subscribers exist in wa_recipients, the digest fans out to all of them
+# on a bounded worker pool, throttled by a token bucket to stay under Meta's throughput limits.
+WA_BROADCAST_WORKERS = int(os.getenv('WA_BROADCAST_WORKERS', '8'))
+WA_BROADCAST_RATE = float(os.getenv('WA_BROADCAST_RATE', '20'))  # messages per second
+WA_BROADCAST_BURST = int(os.getenv('WA_BROADCAST_BURST', '5'))
 
 DB_FILE = "seen_urls.db"
+SEEN_STATE_DIR = "seen_state"  # Sent-URL memory as append-only text segments (committed by the workflows)
+
+# Deep-content cache: successful scrapes are reused for the whole freshness window,
+# failures and timeouts are negatively cached for a shorter period before retrying.
+CONTENT_CACHE_TTL_HOURS = 24
+CONTENT_CACHE_NEGATIVE_TTL_HOURS = 6
+# Article extraction: pages are streamed and tokenized incrementally, stopping once enough
+# paragraph text is collected or DEEP_FETCH_MAX_BYTES have been read.
+DEEP_CONTENT_CHARS = 1000
+SUMMARY_CHARS = 400
+DEEP_FETCH_MAX_BYTES = 512 * 1024
+TRACKING_PARAMS = {'fbclid', 'gclid', 'mc_cid', 'mc_eid', 'ref', 'ref_src', 'cmpid', 'guccounter'}
+
+# Near-duplicate detection: 64-bit SimHash over title + summary. Stories within
+# SIMHASH_DISTANCE bits are merged, both within a run and against the seen history.
+SIMHASH_DISTANCE = 7
+SIMHASH_BANDS = 8  # 8-bit bands; any pair within 7 bits shares at least one band
+SIMHASH_SUMMARY_WORDS = 15
+# Archive dedup: a top-ranked candidate is dropped when its headline shares this share of words
+# (Jaccard, stopwords aside) with a headline sent within SEEN_RETENTION_DAYS, both name the same
+# numbers (versions, prices, percentages) and either their SimHashes are within SIMHASH_DISTANCE
+# or ARCHIVE_DEDUP_SUMMARY_OVERLAP of the shorter summary's words appear in the other one
+ARCHIVE_DEDUP_JACCARD = 0.6
+ARCHIVE_DEDUP_SUMMARY_OVERLAP = 0.7
+ARCHIVE_DEDUP_SUMMARY_WORDS = 40
+ARCHIVE_DEDUP_CANDIDATES = 150
+STOPWORDS = {'the', 'a', 'an', 'of', 'to', 'and', 'in', 'for', 'on', 'with', 'is', 'at', 'by', 'from', 'as', 'its', 'it'}
 
 # News Sources
-RSS_FEEDS = [
+# Each source declares its digest type, how many entries to consider, whether teaser entries may be
+# deep-fetched and its request timeout. Runs only fetch the sources whose type matches the mode.
+# `weight` is the source's prior in local pre-ranking (see score_candidate); `poll_minutes` is how
+# often background ingestion (`--ingest` or the daemon) polls it. `date_ordered` feeds list entries
+# newest-first, so the freshness scan may stop at the first stale one; rank-ordered feeds set it False.
+SOURCE_DEFAULTS = {"max_entries": 25, "deep_fetch": True, "timeout": 10, "weight": 1.0, "poll_minutes": 30,
+                   "date_ordered": True}
+
+SOURCES = [
     # Tech News
-    "https://techcrunch.com/feed/",
-    "http://feeds.arstechnica.com/arstechnica/index",
-    "https://www.theverge.com/rss/index.xml",
-    "https://www.wired.com/feed/rss",
-    "https://venturebeat.com/category/ai/feed/",
-    
+    {"name": "TechCrunch", "kind": "rss", "url": "https://techcrunch.com/feed/", "type": "news", "weight": 1.2},
+    {"name": "Ars Technica", "kind": "rss", "url": "http://feeds.arstechnica.com/arstechnica/index", "type": "news", "weight": 1.1},
+    {"name": "The Verge", "kind": "rss", "url": "https://www.theverge.com/rss/index.xml", "type": "news", "weight": 1.1},
+    {"name": "Wired", "kind": "rss", "url": "https://www.wired.com/feed/rss", "type": "news"},
+    {"name": "VentureBeat AI", "kind": "rss", "url": "https://venturebeat.com/category/ai/feed/", "type": "news"},
+    {"name": "Hacker News", "kind": "rss", "url": "https://news.ycombinator.com/rss", "type": "news", "weight": 0.9, "date_ordered": False},
+
     # AI Research & Engineering
-    "https://openai.com/blog/rss/",
-    "https://research.google/blog/rss/", 
-    "https://www.anthropic.com/rss",
-    "https://huggingface.co/blog/feed.xml",
-    "https://aws.amazon.com/blogs/machine-learning/feed/",
-    "https://news.ycombinator.com/rss", 
-]
+    {"name": "OpenAI Blog", "kind": "rss", "url": "https://openai.com/blog/rss/", "type": "research", "weight": 1.4},
+    {"name": "Google Research", "kind": "rss", "url": "https://research.google/blog/rss/", "type": "research", "weight": 1.3},
+    {"name": "Anthropic", "kind": "rss", "url": "https://www.anthropic.com/rss", "type": "research", "weight": 1.4},
+    {"name": "Hugging Face", "kind": "rss", "url": "https://huggingface.co/blog/feed.xml", "type": "research", "weight": 1.2},
+    {"name": "AWS Machine Learning", "kind": "rss", "url": "https://aws.amazon.com/blogs/machine-learning/feed/", "type": "research", "weight": 0.8},
 
-REDDIT_SUBREDDITS = [
-    "MachineLearning",
-    "artificial",
-    "LocalLLaMA", 
-    "technology",
-    "singularity" 
+    # Reddit
+    {"name": "r/MachineLearning", "kind": "reddit", "subreddit": "MachineLearning", "type": "research", "max_entries": 15, "weight": 0.8, "poll_minutes": 60},
+    {"name": "r/LocalLLaMA", "kind": "reddit", "subreddit": "LocalLLaMA", "type": "research", "max_entries": 15, "weight": 0.8, "poll_minutes": 60},
+    {"name": "r/singularity", "kind": "reddit", "subreddit": "singularity", "type": "research", "max_entries": 15, "weight": 0.8, "poll_minutes": 60},
+    {"name": "r/artificial", "kind": "reddit", "subreddit": "artificial", "type": "news", "max_entries": 15, "weight": 0.7, "poll_minutes": 60},
+    {"name": "r/technology", "kind": "reddit", "subreddit": "technology", "type": "news", "max_entries": 15, "weight": 0.7, "poll_minutes": 60},
 ]
 
 USER_AGENTS = [
@@ -65,194 +117,1926 @@ USER_AGENTS = [
     'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/114.0'
 ]
 
+# Only entries published within this window are candidates; the cutoff is computed once per run.
+FRESHNESS_WINDOW_HOURS = 24
+
+# Local pre-ranking and prompt budget: candidates are scored locally, then packed as compact
+# rows into the Gemini prompt until PROMPT_TOKEN_BUDGET (estimated) is used up.
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '12000'))
+PROMPT_SUMMARY_TOKENS = 60
+FRESHNESS_HALF_LIFE_HOURS = 12
+MODE_KEYWORDS = {
+    "research": ["model", "paper", "arxiv", "benchmark", "training", "weights", "open-source", "open source",
+                 "reasoning", "llm", "transformer", "diffusion", "dataset", "fine-tun", "inference", "agent"],
+    "news": ["launch", "funding", "raises", "acquire", "acquisition", "ipo", "regulation", "lawsuit",
+             "policy", "ban", "layoff", "ceo", "release", "announces", "partnership", "antitrust"],
+}
+
+# Gemini settings. Candidate pools larger than one prompt are shortlisted map-reduce style:
+# shards of SHARD_TOKEN_BUDGET go to concurrent LLM calls, then one reduce call picks the digest.
+GEMINI_MODEL = 'gemini-2.5-flash'
+GEMINI_TEMPERATURE = 0.3
+# LLM client policy: a rate-limited call waits for the retry delay the API returns (when it is at
+# most LLM_MAX_RETRY_DELAY); exhausted quota moves on to the next fallback model. With
+# LLM_HEDGE_AFTER > 0, a call still running after that many seconds gets a duplicate request and
+# the first answer wins.
+GEMINI_FALLBACK_MODELS = [m.strip() for m in os.getenv('GEMINI_FALLBACK_MODELS', 'gemini-2.5-flash-lite').split(',') if m.strip()]
+LLM_MAX_ATTEMPTS = 3
+LLM_DEFAULT_RETRY_DELAY = 20
+LLM_MAX_RETRY_DELAY = 60
+LLM_HEDGE_AFTER = float(os.getenv('LLM_HEDGE_AFTER', '0'))
+SHARD_TOKEN_BUDGET = int(os.getenv('SHARD_TOKEN_BUDGET', '8000'))
+SHORTLIST_PER_SHARD = 12
+LLM_CONCURRENCY = int(os.getenv('LLM_CONCURRENCY', '4'))
+LLM_SHARD_RETRIES = 2
+# Gemini responses are cached by hash(model, temperature, prompt) so a re-run over the same
+# candidates (e.g. after a failed delivery) skips the LLM entirely.
+LLM_CACHE_TTL_HOURS = int(os.getenv('LLM_CACHE_TTL_HOURS', '24'))
+
+# Delivery: per-channel spacing between chunks, and retry policy for rate-limited sends
+TELEGRAM_MIN_INTERVAL = 1.0
+WHATSAPP_MIN_INTERVAL = 1.0
+DELIVERY_BACKOFF = 5
+DELIVERY_MAX_BACKOFF = 60
+DELIVERY_MAX_ATTEMPTS = 5
+OUTBOX_RESUME_HOURS = 24
+# Per-channel message size limits; digests are split on item boundaries to fit them
+TELEGRAM_MAX_CHARS = 4000
+WHATSAPP_MAX_CHARS = 4000
+WHATSAPP_TEMPLATE_VAR_CHARS = 1024  # Meta template body variables
+WA_SHARE_URL = "https://api.whatsapp.com/send?text="
+WA_SHARE_URL_MAX = int(os.getenv('WA_SHARE_URL_MAX', '2048'))  # Telegram button URLs; longer digests get one share button per part
+
+# Daemon mode (`python bot.py`): in-process IST schedules with jitter and missed-run catch-up,
+# plus a small HTTP endpoint for health checks and on-demand runs.
+SCHEDULES = {
+    "news": os.getenv('NEWS_SCHEDULE', '06:00'),          # comma-separated HH:MM, IST
+    "research": os.getenv('RESEARCH_SCHEDULE', '09:00'),
+}
+SCHEDULE_JITTER_SECONDS = int(os.getenv('SCHEDULE_JITTER_SECONDS', '300'))
+CATCHUP_WINDOW_HOURS = int(os.getenv('CATCHUP_WINDOW_HOURS', '6'))
+DAEMON_PORT = int(os.getenv('PORT', os.getenv('DAEMON_PORT', '8080')))
+DAEMON_HOST = os.getenv('DAEMON_HOST', '0.0.0.0' if os.getenv('PORT') else '127.0.0.1')
+DAEMON_TRIGGER_TOKEN = os.getenv('DAEMON_TRIGGER_TOKEN')
+
+# Background ingestion: sources are polled on their own intervals into the `candidates` pool, and
+# job() reads the pool instead of fetching live whenever the mode's sources were polled recently.
+INGEST_TICK_SECONDS = 60
+CANDIDATE_POOL_MAX_AGE_MINUTES = int(os.getenv('CANDIDATE_POOL_MAX_AGE_MINUTES', '120'))
+CANDIDATE_RETENTION_HOURS = 48
+
+# Ingestion concurrency: feeds and deep pages are fetched on a bounded pool,
+# with a cap on simultaneous requests per host and one deadline for the whole stage.
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '16'))
+INGEST_DEADLINE = float(os.getenv('INGEST_DEADLINE', '60'))
+DEFAULT_HOST_CONCURRENCY = 4
+
+# Source health: every feed fetch records its latency and outcome in `source_health`. A source
+# failing BREAKER_THRESHOLD times in a row is skipped (served from the feed cache) for a cooldown
+# that doubles with each further failure, and a healthy source's timeout shrinks to a multiple of
+# its observed p90 latency (never above its configured `timeout`).
+HEALTH_WINDOW = 50  # latencies kept per source
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN_MINUTES = 30
+BREAKER_MAX_COOLDOWN_HOURS = 24
+ADAPTIVE_TIMEOUT_FACTOR = 3.0
+MIN_SOURCE_TIMEOUT = 3.0
+HOST_CONCURRENCY = {
+    "www.reddit.com": 2,  # Reddit rate limits aggressively (Error 429)
+}
+
+# Per-host politeness: requests to a host are spaced by an interval that starts at the host's floor,
+# backs off on 429/503 (or jumps to the server's Retry-After) and relaxes again on success.
+HOST_MIN_INTERVAL = {
+    "www.reddit.com": 1.0,
+}
+HOST_MAX_INTERVAL = 30.0
+RATE_LIMIT_RETRIES = 2
+RATE_LIMIT_MAX_WAIT = 30.0
+
+# All subreddits are fetched in one combined listing (r/a+b+c); selftext and link targets come
+# from the JSON payload, so Reddit pages are never scraped.
+REDDIT_LISTING_URL = "https://www.reddit.com/r/{subreddits}/top.json?t=day&limit={limit}&raw_json=1"
+# The combined listing ranks by raw score across subreddits, so big ones can crowd small ones out of
+# its REDDIT_LISTING_LIMIT slots. When the listing is full, a subreddit with fewer than
+# REDDIT_MIN_POSTS posts in it (or its max_entries, if lower) is re-read from its own listing.
+REDDIT_LISTING_LIMIT = 100
+REDDIT_MIN_POSTS = 10
+
+# Run report: a JSON summary of each job's spans and counters, and a Prometheus textfile
+# (for node_exporter's textfile collector). Both are optional and written at the end of job().
+RUN_REPORT_PATH = os.getenv('RUN_REPORT_PATH')
+PROM_TEXTFILE = os.getenv('PROM_TEXTFILE')
+TRACE_SAMPLES = 1024  # latencies kept per span for percentiles
+
+# --- Tracing ---
+class RunTrace:
+    """Spans and counters for one run. A span costs two perf_counter() calls and a locked dict
+    update; latencies aggregate per span name (count, errors, total, max, recent samples)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, mode=None):
+        with self.lock:
+            self.mode = mode
+            self.status = "running"
+            self.started_at = time.time()
+            self.started = time.perf_counter()
+            self.spans = {}
+            self.counters = defaultdict(float)
+
+    def record(self, name, seconds, error=False):
+        with self.lock:
+            stat = self.spans.get(name)
+            if stat is None:
+                stat = self.spans[name] = {"count": 0, "errors": 0, "total": 0.0, "max": 0.0,
+                                           "samples": deque(maxlen=TRACE_SAMPLES)}
+            stat["count"] += 1
+            stat["errors"] += error
+            stat["total"] += seconds
+            stat["max"] = max(stat["max"], seconds)
+            stat["samples"].append(seconds)
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, error)
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def report(self):
+        with self.lock:
+            spans = {}
+            for name, stat in sorted(self.spans.items()):
+                samples = sorted(stat["samples"])
+                spans[name] = {"count": stat["count"], "errors": stat["errors"], "total_s": round(stat["total"], 6),
+                               "max_s": round(stat["max"], 6),
+                               "p50_s": round(samples[len(samples) // 2], 6),
+                               "p95_s": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 6)}
+            counters = dict(sorted(self.counters.items()))
+        hit_rates = {}
+        for cache in ("feed_cache", "content_cache", "llm_cache"):
+            hits, misses = counters.get(f"{cache}.hits", 0), counters.get(f"{cache}.misses", 0)
+            if hits + misses:
+                hit_rates[cache] = round(hits / (hits + misses), 4)
+        return {"mode": self.mode, "status": self.status, "started_at": datetime.fromtimestamp(self.started_at).isoformat(),
+                "duration_s": round(time.perf_counter() - self.started, 3),
+                "spans": spans, "counters": counters, "cache_hit_rates": hit_rates}
+
+class _CurrentTrace:
+    """TRACE forwards to the RunTrace of the current context. job() installs a fresh one per run
+    (TracedExecutor carries it into worker threads), so background ingestion ticking alongside a
+    run in the daemon records into the process-wide default trace, not into that run's report."""
+
+    def __getattr__(self, name):
+        return getattr(_current_trace.get(), name)
+
+    def __setattr__(self, name, value):
+        setattr(_current_trace.get(), name, value)
+
+_current_trace = contextvars.ContextVar('trace', default=RunTrace())
+TRACE = _CurrentTrace()
+
+class TracedExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor whose tasks run in a copy of the submitter's context, so they trace into its run."""
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+def traced(name):
+    """Decorator form of TRACE.span for whole functions."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with TRACE.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def _prom_name(name):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+def prometheus_text(report):
+    """The run report in the Prometheus text exposition format."""
+    mode = report["mode"] or "all"
+    lines = ["# HELP technews_span_seconds Latency of traced operations in the last run.",
+             "# TYPE technews_span_seconds summary"]
+    for name, stat in report["spans"].items():
+        labels = f'mode="{mode}",span="{name}"'
+        lines += [f'technews_span_seconds{{{labels},quantile="0.5"}} {stat["p50_s"]}',
+                  f'technews_span_seconds{{{labels},quantile="0.95"}} {stat["p95_s"]}',
+                  f'technews_span_seconds_sum{{{labels}}} {stat["total_s"]}',
+                  f'technews_span_seconds_count{{{labels}}} {stat["count"]}']
+    lines += ["# HELP technews_span_errors Traced operations that raised in the last run.",
+              "# TYPE technews_span_errors gauge"]
+    lines += [f'technews_span_errors{{mode="{mode}",span="{name}"}} {stat["errors"]}'
+              for name, stat in report["spans"].items()]
+    lines += ["# HELP technews_run_counter Counters from the last run (retries, cache hits, items, tokens).",
+              "# TYPE technews_run_counter gauge"]
+    lines += [f'technews_run_counter{{mode="{mode}",name="{_prom_name(name)}"}} {value:g}'
+              for name, value in report["counters"].items()]
+    lines += ["# TYPE technews_cache_hit_ratio gauge"]
+    lines += [f'technews_cache_hit_ratio{{mode="{mode}",cache="{cache}"}} {rate}'
+              for cache, rate in report["cache_hit_rates"].items()]
+    lines += ["# TYPE technews_last_run_duration_seconds gauge",
+              f'technews_last_run_duration_seconds{{mode="{mode}"}} {report["duration_s"]}',
+              "# TYPE technews_last_run_success gauge",
+              f'technews_last_run_success{{mode="{mode}"}} {int(report["status"] == "ok")}',
+              "# TYPE technews_last_run_timestamp_seconds gauge",
+              f'technews_last_run_timestamp_seconds{{mode="{mode}"}} {TRACE.started_at:.0f}']
+    return "\n".join(lines) + "\n"
+
+def _write_atomic(path, text):
+    # The textfile collector may read at any moment; never let it see a half-written file
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def emit_run_report():
+    report = TRACE.report()
+    stages = ", ".join(f"{stage} {report['spans'][f'stage.{stage}']['total_s']:.1f}s"
+                       for stage in ("ingest", "rank", "generate", "deliver") if f"stage.{stage}" in report["spans"])
+    print(f"⏱️ Run {report['status']} in {report['duration_s']:.1f}s ({stages})")
+    try:
+        if RUN_REPORT_PATH:
+            _write_atomic(RUN_REPORT_PATH, json.dumps(report, indent=2))
+        if PROM_TEXTFILE:
+            _write_atomic(PROM_TEXTFILE, prometheus_text(report))
+    except OSError as e:
+        print(f"⚠️ Could not write run report: {e}")
+    return report
+
 # --- Database Setup (SQLite replacing JSON) ---
+# One shared connection per process (WAL mode), guarded by DB_LOCK since the fetchers run on worker threads.
+DB_LOCK = threading.RLock()
+SEEN_RETENTION_DAYS = 60
+SEEN_COMPACT_SEGMENTS = 24  # Merge seen_state into one segment (dropping expired lines) past this many files
+_db_conn = None
+_db_path = None
+
+def get_db():
+    global _db_conn, _db_path
+    with DB_LOCK:
+        if _db_conn is None or _db_path != DB_FILE:
+            if _db_conn is not None:
+                _db_conn.close()
+            _db_conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+            _db_conn.execute("PRAGMA journal_mode=WAL")
+            _db_conn.execute("PRAGMA synchronous=NORMAL")
+            _db_path = DB_FILE
+        return _db_conn
+
+def close_db():
+    """Closes the shared connection, which also checkpoints the WAL back into DB_FILE."""
+    global _db_conn, _seen_store
+    with DB_LOCK:
+        if _db_conn is not None:
+            _db_conn.close()
+            _db_conn = None
+        _seen_store = None
+
+atexit.register(close_db)
+
 def init_db():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS seen_urls 
-                 (url TEXT PRIMARY KEY, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
-    conn.commit()
-    conn.close()
+    with DB_LOCK:
+        conn = get_db()
+        c = conn.cursor()
+        c.execute('''CREATE TABLE IF NOT EXISTS seen_urls 
+                     (url TEXT PRIMARY KEY, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_seen_urls_timestamp ON seen_urls (timestamp)")
+        if 'fingerprint' not in {row[1] for row in c.execute("PRAGMA table_info(seen_urls)")}:
+            c.execute("ALTER TABLE seen_urls ADD COLUMN fingerprint INTEGER")
+        c.execute('''CREATE TABLE IF NOT EXISTS feed_cache
+                     (feed_url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, feed_title TEXT,
+                      entries TEXT, fetched_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS content_cache
+                     (url TEXT PRIMARY KEY, text TEXT, status INTEGER, fetched_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_content_cache_fetched_at ON content_cache (fetched_at)")
+        c.execute('''CREATE TABLE IF NOT EXISTS llm_cache
+                     (key TEXT PRIMARY KEY, model TEXT, response TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS digests
+                     (id TEXT PRIMARY KEY, mode TEXT, data TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+        # Searchable archive of every sent digest item, full-text indexed (FTS5, kept in sync by trigger)
+        c.execute('''CREATE TABLE IF NOT EXISTS digest_items
+                     (id INTEGER PRIMARY KEY, digest_id TEXT, mode TEXT, sent_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                      type TEXT, title TEXT, summary TEXT, source TEXT, url TEXT, headline TEXT, fingerprint INTEGER)''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_digest_items_sent_at ON digest_items (sent_at)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_digest_items_digest ON digest_items (digest_id)")
+        c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS digest_items_fts USING fts5
+                     (title, summary, headline, source, content='digest_items', content_rowid='id',
+                      tokenize='porter unicode61')''')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS digest_items_ai AFTER INSERT ON digest_items BEGIN
+                       INSERT INTO digest_items_fts (rowid, title, summary, headline, source)
+                       VALUES (new.id, new.title, new.summary, new.headline, new.source);
+                     END''')
+        c.execute('''CREATE TABLE IF NOT EXISTS outbox
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT, digest_id TEXT, channel TEXT, seq INTEGER, payload TEXT,
+                      status TEXT DEFAULT 'pending', attempts INTEGER DEFAULT 0, last_error TEXT,
+                      created_at DATETIME DEFAULT CURRENT_TIMESTAMP, sent_at DATETIME,
+                      UNIQUE (digest_id, channel, seq))''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox (status, channel)")
+        c.execute('''CREATE TABLE IF NOT EXISTS candidates
+                     (url TEXT PRIMARY KEY, title TEXT, summary TEXT, source TEXT, sources TEXT, alt_urls TEXT,
+                      type TEXT, weight REAL, published_at TEXT, published_ts REAL, fingerprint INTEGER,
+                      ingested_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_candidates_type_published ON candidates (type, published_ts)")
+        c.execute('''CREATE TABLE IF NOT EXISTS source_polls
+                     (name TEXT PRIMARY KEY, last_polled DATETIME)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS source_health
+                     (name TEXT PRIMARY KEY, latencies TEXT, error_streak INTEGER DEFAULT 0, last_error TEXT,
+                      last_count INTEGER, open_until REAL, last_success DATETIME, updated_at DATETIME)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS job_runs
+                     (mode TEXT PRIMARY KEY, last_run DATETIME, last_status TEXT)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS wa_recipients
+                     (phone TEXT PRIMARY KEY, mode TEXT DEFAULT 'text', active INTEGER DEFAULT 1,
+                      last_status TEXT, last_error_code INTEGER, updated_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS wa_deliveries
+                     (digest_id TEXT, phone TEXT, status TEXT, error_code INTEGER, attempts INTEGER DEFAULT 0,
+                      updated_at DATETIME DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (digest_id, phone))''')
+        conn.commit()
+
+def to_signed64(fingerprint):
+    """SimHash fingerprints are unsigned 64-bit; SQLite INTEGER is signed."""
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+def url_key(url):
+    """64-bit BLAKE2b hash of a URL (hex), the form seen_state stores URLs in."""
+    return hashlib.blake2b(url.encode(), digest_size=8).hexdigest()
+
+class SeenStore:
+    """Seen-URL memory kept as append-only text segments in SEEN_STATE_DIR.
+    Every save writes one new, uniquely named segment, so overlapping CI runs never touch the same
+    file and git merges their commits cleanly. A line is "<date> <url hash> <fingerprint or ->",
+    sorted by hash. The whole set is loaded once into memory (expired lines skipped), so membership
+    checks never touch disk; compact() folds the segments into one and drops expired lines."""
+
+    def __init__(self, path=None, retention_days=SEEN_RETENTION_DAYS):
+        self.path = path or SEEN_STATE_DIR
+        self.retention_days = retention_days
+        self.entries = {}
+        self.fingerprints = SimHashIndex()
+        self.segments = self._segment_names()
+        self.expired = 0
+        cutoff = self._date(-retention_days)
+        for name in self.segments:
+            with open(os.path.join(self.path, name)) as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) != 3:
+                        continue
+                    if parts[0] < cutoff:
+                        self.expired += 1
+                        continue
+                    # A URL saved by two runs keeps its first date, like INSERT OR IGNORE did
+                    day, key, fingerprint = parts
+                    if key not in self.entries or day < self.entries[key][0]:
+                        self.entries[key] = (day, fingerprint)
+        for _, fingerprint in self.entries.values():
+            if fingerprint != '-':
+                self.fingerprints.add(int(fingerprint, 16))
+
+    @staticmethod
+    def _date(days=0):
+        return time.strftime('%Y-%m-%d', time.gmtime(time.time() + days * 86400))
+
+    def _segment_names(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(n for n in os.listdir(self.path) if n.startswith('seg-') and n.endswith('.txt'))
+
+    def _write_segment(self, rows):
+        """Writes {url hash: (date, fingerprint)} as a new segment and returns its file name."""
+        os.makedirs(self.path, exist_ok=True)
+        name = f"seg-{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{random.getrandbits(32):08x}.txt"
+        _write_atomic(os.path.join(self.path, name),
+                      "".join(f"{day} {key} {fp}\n" for key, (day, fp) in sorted(rows.items())))
+        self.segments.append(name)
+        return name
+
+    def __contains__(self, url):
+        return url_key(url) in self.entries or url_key(canonical_url(url)) in self.entries
+
+    def seen_many(self, urls):
+        """Returns the subset of urls that has already been sent (raw or canonical form)."""
+        return {u for u in urls if u in self}
+
+    def seen_story(self, fingerprint):
+        """True if a near-duplicate of this story was sent within the retention window."""
+        return self.fingerprints.find(fingerprint) is not None
+
+    def add_many(self, urls, fingerprints=None, day=None):
+        """Records sent URLs (stored canonicalized), with optional {url: fingerprint} for cross-day dedup."""
+        fingerprints = fingerprints or {}
+        day = day or self._date()
+        rows = {}
+        for u in urls:
+            if u and u not in self:
+                fp = fingerprints.get(u)
+                rows[url_key(canonical_url(u))] = (day, '-' if fp is None else f"{fp & 0xFFFFFFFFFFFFFFFF:016x}")
+        if not rows:
+            return 0
+        with DB_LOCK:
+            self._write_segment(rows)
+        self.entries.update(rows)
+        for _, fp in rows.values():
+            if fp != '-':
+                self.fingerprints.add(int(fp, 16))
+        return len(rows)
+
+    def compact(self):
+        """Rewrites every segment as one (live entries only) and removes the old files.
+        Returns the number of expired lines dropped."""
+        with DB_LOCK:
+            old = [n for n in self._segment_names() if n in self.segments]
+            if self.entries:
+                self._write_segment(self.entries)
+            for name in old:
+                os.remove(os.path.join(self.path, name))
+            self.segments = [n for n in self.segments if n not in old]
+        dropped, self.expired = self.expired, 0
+        return dropped
+
+@traced('db.migrate_seen_urls')
+def migrate_seen_urls(store, conn):
+    """One-off import of the legacy seen_urls table into an empty seen_state directory."""
+    if store.segments:
+        return 0
+    try:
+        with DB_LOCK:
+            rows = conn.execute("SELECT url, fingerprint, timestamp FROM seen_urls").fetchall()
+    except sqlite3.OperationalError:
+        return 0
+    # Every row is carried over; retention still applies when the segments are loaded or compacted
+    for url, fingerprint, timestamp in rows:
+        day = str(timestamp or store._date())[:10]
+        key = url_key(url)
+        if key not in store.entries or day < store.entries[key][0]:
+            store.entries[key] = (day, '-' if fingerprint is None else f"{fingerprint & 0xFFFFFFFFFFFFFFFF:016x}")
+            if fingerprint is not None:
+                store.fingerprints.add(fingerprint & 0xFFFFFFFFFFFFFFFF)
+    if store.entries:
+        with DB_LOCK:
+            store._write_segment(store.entries)
+        print(f"🗃️ Migrated {len(store.entries)} seen URLs from {DB_FILE} to {store.path}/")
+    return len(store.entries)
+
+_seen_store = None
+
+@traced('db.get_seen_store')
+def get_seen_store():
+    global _seen_store
+    with DB_LOCK:
+        if _seen_store is None or _seen_store.path != SEEN_STATE_DIR:
+            _seen_store = SeenStore(SEEN_STATE_DIR)
+            migrate_seen_urls(_seen_store, get_db())
+        return _seen_store
 
 def is_url_seen(url):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT 1 FROM seen_urls WHERE url = ?", (url,))
-    result = c.fetchone()
-    conn.close()
-    return result is not None
-
-def save_seen_urls(new_urls):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    for url in new_urls:
+    return url in get_seen_store()
+
+@traced('db.save_seen_urls')
+def save_seen_urls(new_urls, fingerprints=None):
+    store = get_seen_store()
+    try:
+        store.add_many(new_urls, fingerprints)
+    except Exception as e:
+        print(f"⚠️ Seen state write error: {e}")
+
+    # Retention: expired lines are skipped at load and dropped for good when the segments are compacted
+    if len(store.segments) > SEEN_COMPACT_SEGMENTS:
+        dropped = store.compact()
+        print(f"🗜️ Compacted seen state ({len(store.entries)} URLs kept, {dropped} expired dropped)")
+
+@traced('db.load_feed_cache')
+def load_feed_cache(feed_urls):
+    """Returns {feed_url: {etag, last_modified, title, entries}} for every cached feed."""
+    placeholders = ",".join("?" * len(feed_urls))
+    with DB_LOCK:
+        rows = get_db().execute(
+            f"SELECT feed_url, etag, last_modified, feed_title, entries FROM feed_cache WHERE feed_url IN ({placeholders})",
+            list(feed_urls)).fetchall()
+    cache = {}
+    for feed_url, etag, last_modified, title, entries in rows:
         try:
-            c.execute("INSERT OR IGNORE INTO seen_urls (url) VALUES (?)", (url,))
-        except Exception as e:
-            print(f"⚠️ DB Insert Error: {e}")
-    
-    # Auto-cleanup: keep only URLs from the last 60 days
-    c.execute("DELETE FROM seen_urls WHERE timestamp < datetime('now', '-60 days')")
-    conn.commit()
-    conn.close()
+            cache[feed_url] = {"etag": etag, "last_modified": last_modified, "title": title,
+                               "entries": json.loads(entries or "[]")}
+        except ValueError:
+            pass
+    return cache
+
+@traced('db.save_feed_cache')
+def save_feed_cache(feeds):
+    """Stores validators and parsed entries for feeds fetched with a full 200 response."""
+    if not feeds:
+        return
+    with DB_LOCK:
+        conn = get_db()
+        conn.executemany('''INSERT OR REPLACE INTO feed_cache (feed_url, etag, last_modified, feed_title, entries, fetched_at)
+                              VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)''',
+                         [(u, f["etag"], f["last_modified"], f["title"], json.dumps(f["entries"])) for u, f in feeds.items()])
+        conn.commit()
+
+@traced('db.load_source_health')
+def load_source_health(names):
+    """Returns {name: {latencies, error_streak, last_error, last_count, open_until, last_success}}."""
+    placeholders = ",".join("?" * len(names))
+    with DB_LOCK:
+        rows = get_db().execute(
+            f"""SELECT name, latencies, error_streak, last_error, last_count, open_until, last_success
+                FROM source_health WHERE name IN ({placeholders})""", list(names)).fetchall()
+    return {name: {"latencies": json.loads(latencies or "[]"), "error_streak": streak, "last_error": error,
+                   "last_count": count, "open_until": open_until, "last_success": last_success}
+            for name, latencies, streak, error, count, open_until, last_success in rows}
+
+@traced('db.save_source_health')
+def save_source_health(outcomes, health):
+    """Folds this run's outcomes ({name: (latency, error, entry_count)}; error None on success) into
+    the stored stats, opening the breaker of sources that keep failing."""
+    if not outcomes:
+        return
+    now = time.time()
+    rows = []
+    for name, (latency, error, count) in outcomes.items():
+        stats = health.get(name) or {"latencies": [], "error_streak": 0, "last_count": None}
+        if error is None:
+            latencies = (stats["latencies"] + [round(latency, 3)])[-HEALTH_WINDOW:]
+            rows.append((name, json.dumps(latencies), 0, None, count, None, 1))
+            continue
+        streak = stats["error_streak"] + 1
+        open_until = None
+        if streak >= BREAKER_THRESHOLD:
+            cooldown = min(BREAKER_COOLDOWN_MINUTES * 60 * 2 ** (streak - BREAKER_THRESHOLD), BREAKER_MAX_COOLDOWN_HOURS * 3600)
+            open_until = now + cooldown
+            print(f"🔌 {name} failed {streak} times in a row; skipping it for {cooldown / 60:.0f} min")
+        rows.append((name, json.dumps(stats["latencies"]), streak, str(error)[:200], stats["last_count"], open_until, 0))
+    with DB_LOCK:
+        conn = get_db()
+        conn.executemany('''INSERT INTO source_health (name, latencies, error_streak, last_error, last_count, open_until,
+                                                        last_success, updated_at)
+                              VALUES (?, ?, ?, ?, ?, ?, CASE WHEN ? THEN CURRENT_TIMESTAMP END, CURRENT_TIMESTAMP)
+                              ON CONFLICT(name) DO UPDATE SET latencies = excluded.latencies,
+                                  error_streak = excluded.error_streak, last_error = excluded.last_error,
+                                  last_count = excluded.last_count, open_until = excluded.open_until,
+                                  last_success = COALESCE(excluded.last_success, source_health.last_success),
+                                  updated_at = excluded.updated_at''', rows)
+        conn.commit()
+
+@traced('db.load_content_cache')
+def load_content_cache(urls):
+    """Returns {canonical_url: text} for cached scrapes still within their TTL.
+    Negatively cached failures come back as empty strings so they are not retried."""
+    keys = list({canonical_url(u) for u in urls})
+    if not keys:
+        return {}
+    placeholders = ",".join("?" * len(keys))
+    with DB_LOCK:
+        rows = get_db().execute(
+            f'''SELECT url, text FROM content_cache WHERE url IN ({placeholders}) AND
+                  ((status = 200 AND fetched_at >= datetime('now', ?)) OR fetched_at >= datetime('now', ?))''',
+            keys + [f'-{CONTENT_CACHE_TTL_HOURS} hours', f'-{CONTENT_CACHE_NEGATIVE_TTL_HOURS} hours']).fetchall()
+    return {url: text or "" for url, text in rows}
+
+@traced('db.save_content_cache')
+def save_content_cache(results):
+    """Stores {url: (text, status)} scrape results and evicts rows past the longest TTL."""
+    if not results:
+        return
+    ttl = max(CONTENT_CACHE_TTL_HOURS, CONTENT_CACHE_NEGATIVE_TTL_HOURS)
+    with DB_LOCK:
+        conn = get_db()
+        conn.executemany('''INSERT OR REPLACE INTO content_cache (url, text, status, fetched_at)
+                              VALUES (?, ?, ?, CURRENT_TIMESTAMP)''',
+                         [(canonical_url(u), text, status) for u, (text, status) in results.items()])
+        conn.execute("DELETE FROM content_cache WHERE fetched_at < datetime('now', ?)", (f'-{ttl} hours',))
+        conn.commit()
+
+def llm_cache_key(prompt, model=None, temperature=None):
+    model = model or GEMINI_MODEL
+    temperature = GEMINI_TEMPERATURE if temperature is None else temperature
+    return hashlib.sha256(f"{model}\x00{temperature}\x00{prompt}".encode()).hexdigest()
+
+@traced('db.load_llm_response')
+def load_llm_response(key):
+    with DB_LOCK:
+        row = get_db().execute("SELECT response FROM llm_cache WHERE key = ? AND created_at >= datetime('now', ?)",
+                               (key, f'-{LLM_CACHE_TTL_HOURS} hours')).fetchone()
+    return row[0] if row else None
+
+@traced('db.save_llm_response')
+def save_llm_response(key, model, response):
+    with DB_LOCK:
+        conn = get_db()
+        conn.execute("INSERT OR REPLACE INTO llm_cache (key, model, response, created_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
+                     (key, model, response))
+        conn.execute("DELETE FROM llm_cache WHERE created_at < datetime('now', ?)", (f'-{LLM_CACHE_TTL_HOURS} hours',))
+        conn.commit()
+
+@traced('db.save_digest')
+def save_digest(digest_id, mode, data):
+    with DB_LOCK:
+        conn = get_db()
+        conn.execute("INSERT OR REPLACE INTO digests (id, mode, data, created_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
+                     (digest_id, mode, json.dumps(data)))
+        conn.commit()
+
+def load_digest(digest_id):
+    """Returns (mode, data) for a stored digest; a unique ID prefix is enough."""
+    with DB_LOCK:
+        rows = get_db().execute("SELECT mode, data FROM digests WHERE id LIKE ? ORDER BY created_at DESC",
+                                (digest_id + '%',)).fetchall()
+    if len(rows) != 1:
+        return None, None
+    return rows[0][0], json.loads(rows[0][1])
+
+@traced('db.archive_digest')
+def archive_digest(digest_data, mode, sent_at=None):
+    """Adds a sent digest's items to the searchable archive, once per digest ID. Returns the item count."""
+    digest_id = digest_data.get('digest_id')
+    items = [item for item in digest_data.get('items', []) if item.get('url')]
+    with DB_LOCK:
+        conn = get_db()
+        if digest_id and conn.execute("SELECT 1 FROM digest_items WHERE digest_id = ? LIMIT 1", (digest_id,)).fetchone():
+            return 0
+        conn.executemany(
+            """INSERT INTO digest_items (digest_id, mode, sent_at, type, title, summary, source, url, headline, fingerprint)
+               VALUES (?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?, ?, ?, ?, ?, ?, ?)""",
+            [(digest_id, mode, sent_at, item.get('type'), item.get('title'), item.get('summary'), item.get('source'),
+              item['url'], item.get('headline'),
+              None if item.get('fingerprint') is None else to_signed64(item['fingerprint'])) for item in items])
+        conn.commit()
+    return len(items)
+
+def fts_query(text):
+    """Free text as an FTS5 query: every word must match; a trailing * makes it a prefix match."""
+    return " ".join(f'"{w.rstrip("*")}"' + ("*" if w.endswith("*") else "") for w in re.findall(r"\w+\*?", text))
+
+def date_bound(value, end=False):
+    """'2026', '2026-03' or '2026-03-15' as a sent_at bound. An end bound is exclusive and covers
+    the whole year/month/day given. Raises ValueError for anything else."""
+    if not re.fullmatch(r'\d{4}(-\d{2}){0,2}', value):
+        raise ValueError(f"expected YYYY, YYYY-MM or YYYY-MM-DD, got {value!r}")
+    parts = [int(p) for p in value.split('-')]
+    start = datetime(*(parts + [1, 1])[:3])
+    if end:
+        if len(parts) == 1:
+            start = start.replace(year=start.year + 1)
+        elif len(parts) == 2:
+            start = (start + timedelta(days=32)).replace(day=1)
+        else:
+            start += timedelta(days=1)
+    return start.strftime('%Y-%m-%d %H:%M:%S')
+
+@traced('db.search_archive')
+def search_archive(query=None, since=None, until=None, mode=None, limit=50):
+    """Archived digest items matching `query` (free text, see fts_query) sent within [since, until),
+    newest first. Returns (sent_at, mode, type, title, source, url) rows."""
+    dates, params = [], []
+    if since:
+        dates.append("d.sent_at >= ?")
+        params.append(date_bound(since))
+    if until:
+        dates.append("d.sent_at < ?")
+        params.append(date_bound(until, end=True))
+    where = dates + (["d.mode = ?"] if mode and mode != 'all' else [])
+    filters = params + ([mode] if mode and mode != 'all' else [])
+    columns = "SELECT d.sent_at, d.mode, d.type, d.title, d.source, d.url"
+    match = fts_query(query or "")
+    with DB_LOCK:
+        conn = get_db()
+        if not match:
+            sql = f"{columns} FROM digest_items d WHERE {' AND '.join(where or ['1'])} ORDER BY d.sent_at DESC LIMIT ?"
+            return conn.execute(sql, filters + [limit]).fetchall()
+        # Items are archived in send order, so the date range maps onto a rowid range that FTS5 walks
+        # newest-first, stopping at `limit` instead of collecting every match in the archive
+        lo, hi = 0, 1 << 62
+        if dates:
+            lo, hi = conn.execute(f"SELECT MIN(id), MAX(id) FROM digest_items d WHERE {' AND '.join(dates)}",
+                                  params).fetchone()
+            if lo is None:
+                return []
+        sql = (f"{columns} FROM digest_items_fts f JOIN digest_items d ON d.id = f.rowid "
+               f"WHERE digest_items_fts MATCH ? AND f.rowid BETWEEN ? AND ? {''.join(' AND ' + w for w in where)} "
+               "ORDER BY f.rowid DESC LIMIT ?")
+        return conn.execute(sql, [match, lo, hi] + filters + [limit]).fetchall()
+
+def print_archive_search(query, since=None, until=None, mode=None, limit=50):
+    started = time.perf_counter()
+    rows = search_archive(query, since, until, mode, limit)
+    period = f" ({since or '…'} → {until or 'now'})" if since or until else ""
+    print(f"🔎 {len(rows)} archived items matching '{query or '*'}'{period} "
+          f"in {(time.perf_counter() - started) * 1000:.1f} ms:")
+    for sent_at, item_mode, item_type, title, source, url in rows:
+        print(f"{sent_at[:10]}  {item_mode:8} {item_type or ''} {title} — {source}")
+        print(f"            {url}")
 
 # --- Helper Functions ---
+def canonical_url(url):
+    """Normalizes a URL so copies of one story compare equal: https, lowercase host without
+    www./m./default port, no fragment or trailing slash, tracking params dropped, query sorted."""
+    try:
+        parts = urllib.parse.urlsplit(url.strip())
+    except Exception:
+        return url
+    host = (parts.hostname or '').lower()
+    for prefix in ('www.', 'm.', 'old.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+    path = parts.path.rstrip('/') or '/'
+    query = sorted((k, v) for k, v in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+                   if not k.lower().startswith('utm_') and k.lower() not in TRACKING_PARAMS)
+    return urllib.parse.urlunsplit(('https', host, path, urllib.parse.urlencode(query), ''))
+
+def simhash(text, title=''):
+    """64-bit SimHash over word unigrams and bigrams. Copies of a story share a headline rather than
+    a body, so only the opening words of the text are used and the title carries 3x their weight."""
+    def features(chunk, limit=None):
+        words = [w for w in re.findall(r'[a-z0-9]+', chunk.lower()) if w not in STOPWORDS][:limit]
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    title_features, text_features = features(title), features(text, SIMHASH_SUMMARY_WORDS)
+    title_weight = max(3, 3 * len(text_features) // max(1, len(title_features)))
+    counts = [0] * 64
+    for weight, feats in ((title_weight, title_features), (1, text_features)):
+        for feature in feats:
+            h = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), 'big')
+            for i in range(64):
+                counts[i] += weight if (h >> i) & 1 else -weight
+    return sum(1 << i for i in range(64) if counts[i] > 0)
+
+def story_fingerprint(item):
+    return simhash(item.summary, item.title)
+
+class SimHashIndex:
+    """Banded lookup of fingerprints within SIMHASH_DISTANCE bits of a query."""
+
+    def __init__(self):
+        self.bands = [dict() for _ in range(SIMHASH_BANDS)]
+
+    def _keys(self, fingerprint):
+        width = 64 // SIMHASH_BANDS
+        mask = (1 << width) - 1
+        return [(fingerprint >> (i * width)) & mask for i in range(SIMHASH_BANDS)]
+
+    def add(self, fingerprint, value=True):
+        for band, key in zip(self.bands, self._keys(fingerprint)):
+            band.setdefault(key, []).append((fingerprint, value))
+
+    def find(self, fingerprint):
+        """Returns the value stored with the first near-duplicate, or None."""
+        for band, key in zip(self.bands, self._keys(fingerprint)):
+            for other, value in band.get(key, ()):
+                if bin(fingerprint ^ other).count('1') <= SIMHASH_DISTANCE:
+                    return value
+        return None
+
+@traced('dedup.cluster')
+def cluster_stories(items):
+    """Merges copies of the same story (same canonical URL or near-duplicate SimHash) into one
+    candidate. The candidate keeps the most informative copy and lists every source and URL."""
+    clusters, by_url, index = [], {}, SimHashIndex()
+    for item in items:
+        item.fingerprint = story_fingerprint(item)
+        key = canonical_url(item.url)
+        cluster = by_url.get(key)
+        if cluster is None:
+            cluster = index.find(item.fingerprint)
+        if cluster is None:
+            cluster = []
+            clusters.append(cluster)
+            index.add(item.fingerprint, cluster)
+        cluster.append(item)
+        by_url[key] = cluster
+
+    merged = []
+    for cluster in clusters:
+        # Prefer publisher feeds over Reddit, then the longest summary
+        best = max(cluster, key=lambda i: (not i.source.startswith('r/'), len(i.summary)))
+        best.sources = list(dict.fromkeys(i.source for i in cluster))
+        best.weight = max(i.weight for i in cluster)
+        best.alt_urls = [u for u in dict.fromkeys(i.url for i in cluster) if u != best.url]
+        merged.append(best)
+    return merged
+
+class TextExtractor(HTMLParser):
+    """Incremental HTML-to-text tokenizer that stops collecting once `limit` characters are reached.
+    In paragraph mode it keeps only <p> blocks longer than 20 characters (whitespace-normalized);
+    otherwise it keeps all text outside script/style, like BeautifulSoup's get_text()."""
+    SKIP_TAGS = {'script', 'style', 'noscript', 'template', 'svg'}
+
+    def __init__(self, limit, paragraphs=True):
+        super().__init__(convert_charrefs=True)
+        self.limit = limit
+        self.paragraphs = paragraphs
+        self.parts = []
+        self.size = 0
+        self.skip_depth = 0
+        self.current = None
+        self.done = False
+
+    def _add(self, text):
+        self.parts.append(text)
+        self.size += len(text) + (1 if self.paragraphs else 0)
+        self.done = self.size >= self.limit
+
+    def _close_paragraph(self):
+        if self.current is not None:
+            text = " ".join("".join(self.current).split())
+            self.current = None
+            if len(text) > 20:
+                self._add(text)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag == 'p' and self.paragraphs:
+            self._close_paragraph()
+            self.current = []
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag == 'p' and self.paragraphs:
+            self._close_paragraph()
+
+    def handle_data(self, data):
+        if self.done or self.skip_depth:
+            return
+        if not self.paragraphs:
+            self._add(data)
+        elif self.current is not None:
+            self.current.append(data)
+
+    def text(self):
+        self._close_paragraph()
+        return (" " if self.paragraphs else "").join(self.parts)[:self.limit]
+
+def extract_paragraphs(chunks, limit=DEEP_CONTENT_CHARS, encoding=None, max_bytes=DEEP_FETCH_MAX_BYTES):
+    """Feeds byte chunks through TextExtractor until `limit` characters of paragraph text or
+    `max_bytes` are reached. Falls back to a full BeautifulSoup parse only when a page that was
+    read completely yields nothing (or trips the tokenizer). Returns None when `max_bytes` is hit
+    before any paragraph text (e.g. a huge inline <script> in <head>): the page was not extracted."""
+    try:
+        decoder = codecs.getincrementaldecoder(encoding or 'utf-8')(errors='replace')
+    except LookupError:
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    parser = TextExtractor(limit)
+    raw, read = [], 0
+    try:
+        for chunk in chunks:
+            raw.append(chunk)
+            read += len(chunk)
+            parser.feed(decoder.decode(chunk))
+            if parser.done or read >= max_bytes:
+                return parser.text() or None
+        parser.feed(decoder.decode(b'', final=True))
+        parser.close()
+        text = parser.text()
+        if text:
+            return text
+    except Exception:
+        pass
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(b"".join(raw), 'html.parser')
+    paragraphs = (p.get_text(" ", strip=True) for p in soup.find_all('p'))
+    return " ".join(t for t in paragraphs if len(t) > 20)[:limit]
+
 def clean_html(html_content):
     if not html_content:
         return ""
-    soup = BeautifulSoup(html_content, "html.parser")
-    return soup.get_text()[:400] + "..."
-
-def fetch_deep_article_content(url):
-    """Visits the actual URL to grab real paragraph text for a better LLM summary."""
+    if '<' not in html_content and '&' not in html_content:
+        return html_content[:SUMMARY_CHARS] + "..."
     try:
-        headers = {'User-Agent': random.choice(USER_AGENTS)}
-        r = requests.get(url, headers=headers, timeout=5)
-        if r.status_code == 200:
-            soup = BeautifulSoup(r.content, 'html.parser')
-            # Extract text from paragraphs
-            paragraphs = soup.find_all('p')
-            text = " ".join([p.get_text(strip=True) for p in paragraphs if len(p.get_text(strip=True)) > 20])
-            return text[:1000] # Return the first 1000 characters
+        parser = TextExtractor(SUMMARY_CHARS, paragraphs=False)
+        parser.feed(html_content)
+        parser.close()
+        text = parser.text()
     except Exception:
-        pass
-    return ""
+        from bs4 import BeautifulSoup
+        text = BeautifulSoup(html_content, "html.parser").get_text()[:SUMMARY_CHARS]
+    return text + "..."
+
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+def _host_semaphore(url):
+    host = urllib.parse.urlsplit(url).netloc.lower()
+    with _host_semaphores_lock:
+        sem = _host_semaphores.get(host)
+        if sem is None:
+            sem = threading.BoundedSemaphore(HOST_CONCURRENCY.get(host, DEFAULT_HOST_CONCURRENCY))
+            _host_semaphores[host] = sem
+        return sem
+
+def parse_date(value):
+    """dateutil's parser (imported on first use)."""
+    from dateutil import parser as date_parser
+    return date_parser.parse(value)
+
+def retry_after_seconds(headers, default=None):
+    """Seconds to wait from a Retry-After header (delta-seconds or an HTTP date)."""
+    value = (headers or {}).get('Retry-After')
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parse_date(value).timestamp() - time.time())
+        except Exception:
+            return default
+
+class HostRateLimiter:
+    """Adaptive per-host request spacing. Each host gets the next free slot on its own timeline;
+    a 429/503 doubles the host's interval (and honours Retry-After), successes shrink it back."""
+
+    def __init__(self, floors=None, ceiling=HOST_MAX_INTERVAL):
+        self.floors = floors or {}
+        self.ceiling = ceiling
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _state(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = {"interval": self.floors.get(host, 0.0), "next": 0.0}
+        return state
+
+    def wait(self, host):
+        with self._lock:
+            state = self._state(host)
+            now = time.monotonic()
+            slot = max(now, state["next"])
+            state["next"] = slot + state["interval"]
+        if slot > now:
+            time.sleep(slot - now)
+
+    def observe(self, host, status, retry_after=None):
+        with self._lock:
+            state = self._state(host)
+            floor = self.floors.get(host, 0.0)
+            if status in (429, 503):
+                state["interval"] = min(self.ceiling, max(state["interval"] * 2, floor, 1.0))
+                pause = retry_after if retry_after is not None else state["interval"]
+                state["next"] = max(state["next"], time.monotonic() + pause)
+            else:
+                state["interval"] = max(floor, state["interval"] * 0.75)
+
+    def interval(self, host):
+        with self._lock:
+            return self._state(host)["interval"]
+
+host_limiter = HostRateLimiter(HOST_MIN_INTERVAL)
+
+@contextmanager
+def http_get(url, timeout=10, **kwargs):
+    """GET with a random User-Agent, throttled by the per-host concurrency cap and rate limiter.
+    A 429 is retried (up to RATE_LIMIT_RETRIES) when the server asks for a short enough wait.
+    Use as `with http_get(...) as r:`; the host's concurrency slot is held until the block ends,
+    so a streamed body is read under the cap too, and the response is closed on exit."""
+    headers = {'User-Agent': random.choice(USER_AGENTS)}
+    headers.update(kwargs.pop('headers', None) or {})
+    host = urllib.parse.urlsplit(url).netloc.lower()
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        host_limiter.wait(host)
+        with _host_semaphore(url):
+            r = http_session('ingest').get(url, headers=headers, timeout=timeout, **kwargs)
+            retry_after = retry_after_seconds(r.headers)
+            host_limiter.observe(host, r.status_code, retry_after)
+            if r.status_code != 429 or attempt == RATE_LIMIT_RETRIES or (retry_after or 0) > RATE_LIMIT_MAX_WAIT:
+                try:
+                    yield r
+                finally:
+                    r.close()
+                return
+            r.close()
+        TRACE.incr('http.rate_limited')
+        print(f"⏳ {host} rate limited (429); retrying in {host_limiter.interval(host) if retry_after is None else retry_after:.0f}s")
+
+def run_parallel(fn, args_list, deadline, workers=INGEST_WORKERS):
+    """Runs fn(*args) for each args tuple on a bounded thread pool.
+    Results keep input order; calls that raise or miss the deadline (a time.monotonic() value) yield None."""
+    results = [None] * len(args_list)
+    if not args_list:
+        return results
+    pool = TracedExecutor(max_workers=min(workers, len(args_list)))
+    futures = {pool.submit(fn, *args): i for i, args in enumerate(args_list)}
+    done, not_done = wait(futures, timeout=max(0, deadline - time.monotonic()))
+    for future in done:
+        try:
+            results[futures[future]] = future.result()
+        except Exception as e:
+            print(f"⚠️ Worker Error in {getattr(fn, '__name__', fn)}: {e}")
+    if not_done:
+        print(f"⏱️ {len(not_done)} {getattr(fn, '__name__', 'task')} call(s) missed the ingestion deadline")
+    pool.shutdown(wait=False, cancel_futures=True)
+    return results
+
+def iter_capped(response, seconds, chunk_size=16384):
+    """iter_content that gives up once the whole body has taken longer than `seconds`. requests'
+    timeout only bounds each read, so a server trickling bytes could otherwise hold a worker forever."""
+    give_up = time.monotonic() + seconds
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        if time.monotonic() > give_up:
+            response.close()
+            raise TimeoutError(f"body not received within {seconds:g}s")
+        yield chunk
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else None
+
+def source_timeout(source, stats):
+    """The source's configured timeout, tightened to ADAPTIVE_TIMEOUT_FACTOR x its p90 latency once
+    enough samples exist, so a normally fast feed that stalls is cut off early."""
+    latencies = (stats or {}).get("latencies") or []
+    if len(latencies) < 5:
+        return source["timeout"]
+    return min(source["timeout"], max(MIN_SOURCE_TIMEOUT, ADAPTIVE_TIMEOUT_FACTOR * percentile(latencies, 0.9)))
 
-def is_within_24_hours(published_date_str):
-    if not published_date_str:
-         return True
+def breaker_open(stats, now=None):
+    return bool(stats and stats.get("open_until") and stats["open_until"] > (now or time.time()))
+
+@traced('fetch.article')
+def scrape_article(url):
+    """Downloads a page and extracts paragraph text. Returns (text, status); status 0 means the request failed."""
     try:
-        pub_date = date_parser.parse(published_date_str)
-        if pub_date.tzinfo is None:
-             pub_date = pytz.utc.localize(pub_date)
-        now = datetime.now(pytz.utc)
-        return (now - pub_date) < timedelta(hours=24)
+        with http_get(url, timeout=5, stream=True) as r:
+            if r.status_code != 200:
+                return "", r.status_code
+            # requests assumes ISO-8859-1 for text/* without a charset; most pages are UTF-8
+            charset = r.encoding if 'charset' in r.headers.get('Content-Type', '').lower() else None
+            text = extract_paragraphs(iter_capped(r, 5), encoding=charset)
+            # Capped before any text: a failure (negatively cached), not an empty article for CONTENT_CACHE_TTL_HOURS
+            return ("", 413) if text is None else (text, 200)
     except Exception:
-        return True
+        return "", 0
+
+def fetch_deep_article_content(url):
+    """Visits the actual URL to grab real paragraph text for a better LLM summary."""
+    return deep_fetch_many([url], time.monotonic() + INGEST_DEADLINE)[url]
+
+def deep_fetch_many(urls, deadline):
+    """Deep-fetches every URL in parallel through the content cache; returns {url: text}.
+    Failures come back as empty text; deadline misses are returned empty but not cached."""
+    unique = list(dict.fromkeys(urls))
+    cached = load_content_cache(unique)
+    missing = [u for u in unique if canonical_url(u) not in cached]
+    TRACE.incr('content_cache.hits', len(unique) - len(missing))
+    TRACE.incr('content_cache.misses', len(missing))
+    if unique:
+        print(f"📄 Deep content: {len(unique) - len(missing)} cached, {len(missing)} to fetch")
+    results = run_parallel(scrape_article, [(u,) for u in missing], deadline)
+    scraped = {u: r for u, r in zip(missing, results) if r is not None}
+    save_content_cache(scraped)
+    return {u: cached.get(canonical_url(u)) or (scraped.get(u) or ("", 0))[0] for u in unique}
+
+# --- Candidate Model ---
+@dataclass(slots=True)
+class NewsItem:
+    """One candidate story. `published_ts` is its UTC epoch, parsed once at ingestion; `sources`,
+    `alt_urls` and `fingerprint` are filled in when copies of the story are clustered."""
+    title: str
+    summary: str
+    source: str
+    url: str
+    published_ts: float
+    type: str
+    weight: float = 1.0
+    deep_fetch: bool = True
+    fingerprint: int = None
+    sources: list = field(default_factory=list)
+    alt_urls: list = field(default_factory=list)
+
+    @property
+    def published_at(self):
+        return datetime.fromtimestamp(self.published_ts, pytz.utc).isoformat()
+
+def freshness_cutoff():
+    """Epoch before which entries are too old to be candidates."""
+    return time.time() - FRESHNESS_WINDOW_HOURS * 3600
+
+def entry_epoch(entry):
+    """An entry record's UTC epoch, or None when undated. Feed cache rows written before `ts`
+    existed still carry the raw date strings and are parsed here."""
+    if "ts" in entry:
+        return entry["ts"]
+    published = entry.get("published") or entry.get("updated")
+    return published_epoch(published) if published else None
+
+def fresh_entries(entries, cutoff, limit, date_ordered=True):
+    """Yields (entry, epoch) for the first `limit` entries published at or after `cutoff`; undated
+    entries count as fresh. For a `date_ordered` source that has also shown itself newest-first,
+    the first stale entry ends the scan, since everything after it is older still."""
+    previous = None
+    newest_first = True
+    for entry in entries[:limit]:
+        ts = entry_epoch(entry)
+        if ts is not None:
+            if ts < cutoff:
+                if date_ordered and newest_first and previous is not None:
+                    return
+                continue
+            if previous is not None and ts > previous:
+                newest_first = False
+            previous = ts
+        yield entry, ts
 
 # --- Fetching Logic ---
-def fetch_rss_news():
-    news_items = []
-    print("📡 Fetching RSS feeds...")
-    for feed_url in RSS_FEEDS:
+def _entry_record(entry):
+    """The subset of a feedparser entry we use, as plain JSON-serializable data. `ts` comes from
+    feedparser's already-parsed struct_time, so dates are never parsed a second time."""
+    parsed = entry.get('published_parsed') or entry.get('updated_parsed')
+    return {
+        "title": entry.get('title', ''),
+        "link": entry.get('link', ''),
+        "summary": entry.get('summary', ''),
+        "ts": calendar.timegm(parsed) if parsed else None,
+    }
+
+def fetch_feed(feed_url, cached=None, timeout=10):
+    """Conditional GET of a feed. Returns {title, entries, etag, last_modified, status} where
+    status is 200 for a fresh body or 304 when the cached entries are still current."""
+    headers = {}
+    if cached:
+        if cached.get("etag"):
+            headers['If-None-Match'] = cached["etag"]
+        if cached.get("last_modified"):
+            headers['If-Modified-Since'] = cached["last_modified"]
+    with TRACE.span('fetch.feed'), http_get(feed_url, timeout=timeout, headers=headers, stream=True) as r:
+        body = b"".join(iter_capped(r, timeout))
+    TRACE.incr('http.bytes', len(body))
+    if r.status_code == 304 and cached:
+        TRACE.incr('feed_cache.hits')
+        return dict(cached, status=304)
+    TRACE.incr('feed_cache.misses')
+    if r.status_code != 200:
+        raise RuntimeError(f"HTTP {r.status_code}")
+    import feedparser
+    with TRACE.span('parse.feed'):
+        feed = feedparser.parse(body, response_headers=r.headers)
+    return {
+        "title": feed.feed.get('title', 'Unknown Source'),
+        "entries": [_entry_record(e) for e in feed.entries],
+        "etag": r.headers.get('ETag'),
+        "last_modified": r.headers.get('Last-Modified'),
+        "status": 200,
+    }
+
+def sources_for(mode='all', kind=None):
+    """Registry entries relevant to a run mode, with SOURCE_DEFAULTS filled in."""
+    return [dict(SOURCE_DEFAULTS, **src) for src in SOURCES
+            if (mode == 'all' or src["type"] == mode) and (kind is None or src["kind"] == kind)]
+
+def source_feed_url(source):
+    return source["url"]
+
+def reddit_listing_url(sources):
+    return REDDIT_LISTING_URL.format(subreddits="+".join(s["subreddit"] for s in sources), limit=REDDIT_LISTING_LIMIT)
+
+def _reddit_entry(post):
+    """A Reddit listing child as a feed entry; `target` is the external article for link posts."""
+    return {
+        "title": post.get("title", ""),
+        "link": "https://www.reddit.com" + post.get("permalink", ""),
+        "summary": post.get("selftext") or "",
+        "ts": post.get("created_utc"),
+        "subreddit": (post.get("subreddit") or "").lower(),
+        "target": None if post.get("is_self") else reddit_link_target(post.get("url_overridden_by_dest") or post.get("url")),
+    }
+
+def fetch_reddit_listing(sources, cached=None, timeout=10):
+    """One conditional GET of the combined top listing for all the subreddits, shaped like fetch_feed's result."""
+    headers = {}
+    if cached:
+        if cached.get("etag"):
+            headers['If-None-Match'] = cached["etag"]
+        if cached.get("last_modified"):
+            headers['If-Modified-Since'] = cached["last_modified"]
+    with TRACE.span('fetch.reddit'), http_get(reddit_listing_url(sources), timeout=timeout, headers=headers,
+                                              stream=True) as r:
+        body = b"".join(iter_capped(r, timeout))
+    TRACE.incr('http.bytes', len(body))
+    if r.status_code == 304 and cached:
+        TRACE.incr('feed_cache.hits')
+        return dict(cached, status=304)
+    TRACE.incr('feed_cache.misses')
+    if r.status_code != 200:
+        raise RuntimeError(f"HTTP {r.status_code}")
+    with TRACE.span('parse.reddit'):
+        children = json.loads(body).get("data", {}).get("children", [])
+    return {
+        "title": "Reddit",
+        "entries": [_reddit_entry(child.get("data", {})) for child in children],
+        "etag": r.headers.get('ETag'),
+        "last_modified": r.headers.get('Last-Modified'),
+        "status": 200,
+    }
+
+def top_up_reddit(sources, entries, deadline):
+    """Listing entries with every subreddit the full combined listing under-represents replaced by
+    the posts of its own listing (through the feed cache and the same host rate limiter).
+    Returns (entries, names of the sources whose top-up failed)."""
+    counts = Counter(entry["subreddit"] for entry in entries)
+    failed = set()
+    short = [s for s in sources if counts[s["subreddit"].lower()] < min(REDDIT_MIN_POSTS, s["max_entries"])]
+    if short and len(entries) >= REDDIT_LISTING_LIMIT:
+        print(f"👽 Topping up {len(short)} subreddit(s) crowded out of the combined listing: "
+              + ", ".join(s["name"] for s in short))
+        TRACE.incr('reddit.top_ups', len(short))
+        urls = [reddit_listing_url([s]) for s in short]
+        cache = load_feed_cache(urls)
+
+        def subreddit_listing(source, url):
+            return fetch_reddit_listing([source], cache.get(url), timeout=source["timeout"])
+
+        feeds = run_parallel(subreddit_listing, list(zip(short, urls)), deadline)
+        save_feed_cache({url: feed for url, feed in zip(urls, feeds) if feed and feed["status"] == 200})
+        replaced = {s["subreddit"].lower() for s, feed in zip(short, feeds) if feed}
+        failed = {s["name"] for s, feed in zip(short, feeds) if not feed}
+        entries = [e for e in entries if e["subreddit"] not in replaced] + \
+                  [e for feed in feeds if feed for e in feed["entries"]]
+        counts = Counter(entry["subreddit"] for entry in entries)
+    for source in sources:
+        if not counts[source["subreddit"].lower()]:
+            print(f"🫥 {source['name']} contributed no posts to the Reddit listing")
+    return entries, failed
+
+@traced('ingest.feeds')
+def fetch_feeds(sources, deadline, polled=None):
+    """Fetches the sources' feeds in parallel through the conditional-GET cache; returns {name: feed}.
+    A feed that errors or misses the deadline falls back to its cached entries, if any. The names of
+    sources actually fetched (200 or 304) are added to the `polled` set, when given."""
+    feed_urls = [source_feed_url(src) for src in sources]
+    cache = load_feed_cache(feed_urls)
+    health = load_source_health([src["name"] for src in sources])
+    outcomes = {}
+
+    def task(source, feed_url):
+        stats = health.get(source["name"])
+        if breaker_open(stats):
+            print(f"🔌 Skipping {source['name']} (circuit open after {stats['error_streak']} failures)")
+            return None
+        started = time.monotonic()
         try:
-            feed = feedparser.parse(feed_url)
-            for entry in feed.entries[:25]:
-                published = getattr(entry, 'published', getattr(entry, 'updated', None))
-                if published and not is_within_24_hours(published):
-                    continue
-                
-                url = entry.link
-                if is_url_seen(url):
-                    continue
-
-                rss_summary = clean_html(getattr(entry, 'summary', ''))
-                # Fetch deeper content if summary is too short (teaser problem)
-                deep_content = ""
-                if len(rss_summary) < 150:
-                    deep_content = fetch_deep_article_content(url)
-
-                is_research = "research" in feed_url or "blog" in feed_url
-                news_items.append({
-                    "title": entry.title,
-                    "summary": deep_content if deep_content else rss_summary,
-                    "source": feed.feed.get('title', 'Unknown Source'),
-                    "url": url,
-                    "published_at": published or datetime.now().isoformat(),
-                    "type": "research" if is_research else "news"
-                })
+            feed = fetch_feed(feed_url, cache.get(feed_url), timeout=source_timeout(source, stats))
+            outcomes[source["name"]] = (time.monotonic() - started, None, len(feed["entries"]))
+            return feed
         except Exception as e:
-            print(f"⚠️ Error fetching {feed_url}: {e}")
-    return news_items
+            outcomes[source["name"]] = (time.monotonic() - started, e, None)
+            print(f"⚠️ Error fetching {source['name']}: {e}")
+            return None
 
-def fetch_reddit_news():
+    results = run_parallel(task, list(zip(sources, feed_urls)), deadline)
+    feeds, refreshed, not_modified = {}, {}, 0
+    for source, feed_url, feed in zip(sources, feed_urls, results):
+        if feed is None and source["name"] not in outcomes and not breaker_open(health.get(source["name"])):
+            # Still running at the deadline: counts against the source like any other failure
+            outcomes[source["name"]] = (None, "missed the ingestion deadline", None)
+        if feed is not None and polled is not None:
+            polled.add(source["name"])
+        if feed is None:
+            feed = cache.get(feed_url)
+            if feed:
+                print(f"🗄️ Using cached entries for {source['name']}")
+        elif feed["status"] == 200:
+            refreshed[feed_url] = feed
+        else:
+            not_modified += 1
+        if feed:
+            feeds[source["name"]] = feed
+    save_feed_cache(refreshed)
+    save_source_health(dict(outcomes), health)
+    if not_modified:
+        print(f"♻️ {not_modified} feed(s) unchanged since last run (304)")
+    return feeds
+
+def _needs_deep_fetch(item):
+    # Teaser summaries (and Reddit placeholders) are replaced with the article's own text
+    return len(item.summary) < 150
+
+@traced('ingest.deep_content')
+def fill_deep_content(items, deadline):
+    pending = [item for item in items if item.deep_fetch and _needs_deep_fetch(item)]
+    deep = deep_fetch_many([item.url for item in pending], deadline)
+    for item in pending:
+        if deep.get(item.url):
+            item.summary = deep[item.url]
+    return items
+
+def fetch_rss_news(deadline=None, deep=True, mode='all', sources=None, cutoff=None, polled=None):
     news_items = []
-    print("👽 Fetching Reddit top posts...")
-    
-    for sub in REDDIT_SUBREDDITS:
-        url = f"https://www.reddit.com/r/{sub}/top/.rss?t=day&limit=10"
-        headers = {'User-Agent': random.choice(USER_AGENTS)}
-        try:
-            response = requests.get(url, headers=headers, timeout=10)
-            if response.status_code == 200:
-                feed = feedparser.parse(response.content)
-                for entry in feed.entries[:15]:
-                    published = getattr(entry, 'updated', None)
-                    if published and not is_within_24_hours(published):
-                        continue
-                        
-                    post_url = entry.link
-                    if is_url_seen(post_url):
-                        continue
+    sources = [s for s in (sources or sources_for(mode)) if s["kind"] == "rss"]
+    if not sources:
+        return news_items
+    print(f"📡 Fetching {len(sources)} RSS feeds...")
+    if deadline is None:
+        deadline = time.monotonic() + INGEST_DEADLINE
 
-                    # Attempt to extract some actual text from Reddit if possible
-                    deep_content = fetch_deep_article_content(post_url)
-                        
-                    is_research = sub in ["MachineLearning", "LocalLLaMA", "singularity"]
-                    news_items.append({
-                        "title": entry.title,
-                        "summary": deep_content if deep_content else "Reddit Discussion",
-                        "source": f"r/{sub}",
-                        "url": post_url,
-                        "published_at": published or datetime.now().isoformat(),
-                        "type": "research" if is_research else "news"
-                    })
-            else:
-                print(f"⚠️ Reddit Error {response.status_code} for r/{sub}")
-            
-            # Prevent rate limiting (Error 429)
-            time.sleep(2)
-        except Exception as e:
-            print(f"⚠️ Error fetching r/{sub}: {e}")
-            
-    return news_items
+    cutoff = freshness_cutoff() if cutoff is None else cutoff
+    now = time.time()
+
+    feeds = fetch_feeds(sources, deadline, polled)
+    seen = get_seen_store().seen_many(e["link"] for f in feeds.values() for e in f["entries"])
+    for source in sources:
+        feed = feeds.get(source["name"])
+        if not feed:
+            continue
+        for entry, published_ts in fresh_entries(feed["entries"], cutoff, source["max_entries"], source["date_ordered"]):
+            url = entry["link"]
+            if not url or url in seen:
+                continue
+
+            news_items.append(NewsItem(
+                title=entry["title"],
+                summary=clean_html(entry["summary"]),
+                source=feed["title"],
+                url=url,
+                published_ts=published_ts or now,
+                type=source["type"],
+                deep_fetch=source["deep_fetch"],
+                weight=source["weight"],
+            ))
+
+    # Fetch deeper content if summary is too short (teaser problem)
+    return fill_deep_content(news_items, deadline) if deep else news_items
+
+def fetch_reddit_news(deadline=None, deep=True, mode='all', sources=None, cutoff=None, polled=None):
+    news_items = []
+    sources = [s for s in (sources or sources_for(mode)) if s["kind"] == "reddit"]
+    if not sources:
+        return news_items
+    print(f"👽 Fetching Reddit top posts from {len(sources)} subreddits in one request...")
+    if deadline is None:
+        deadline = time.monotonic() + INGEST_DEADLINE
+
+    listing_url = reddit_listing_url(sources)
+    cached = load_feed_cache([listing_url]).get(listing_url)
+    # The combined listing is tracked (and circuit-broken) as one source
+    health = load_source_health(["Reddit"])
+    stats = health.get("Reddit")
+    started = time.monotonic()
+    fetched = False
+    try:
+        if breaker_open(stats):
+            raise RuntimeError(f"circuit open after {stats['error_streak']} failures")
+        feed = fetch_reddit_listing(sources, cached, timeout=source_timeout(max(sources, key=lambda s: s["timeout"]), stats))
+        fetched = True
+        save_source_health({"Reddit": (time.monotonic() - started, None, len(feed["entries"]))}, health)
+        if feed["status"] == 200:
+            save_feed_cache({listing_url: feed})
+    except Exception as e:
+        if not breaker_open(stats):
+            save_source_health({"Reddit": (time.monotonic() - started, e, None)}, health)
+        print(f"⚠️ Error fetching Reddit: {e}")
+        feed = cached
+        if feed:
+            print("🗄️ Using cached entries for Reddit")
+    if not feed:
+        return news_items
+
+    cutoff = freshness_cutoff() if cutoff is None else cutoff
+    now = time.time()
+    entries, failed = top_up_reddit(sources, feed["entries"], deadline)
+    if fetched and polled is not None:
+        polled.update(s["name"] for s in sources if s["name"] not in failed)
+    by_subreddit = {s["subreddit"].lower(): s for s in sources}
+    taken = dict.fromkeys(by_subreddit, 0)
+    seen = get_seen_store().seen_many([e["link"] for e in entries] + [e["target"] for e in entries if e["target"]])
+    for entry in entries:
+        source = by_subreddit.get(entry["subreddit"])
+        if not source or taken[entry["subreddit"]] >= source["max_entries"]:
+            continue
+        taken[entry["subreddit"]] += 1
+        # The listing is ordered by score, not date, so there is no early exit here
+        published_ts = entry_epoch(entry)
+        if published_ts is not None and published_ts < cutoff:
+            continue
+
+        post_url = entry["link"]
+        # Link posts point at an article: use it so the story merges with the publisher's copy
+        target = entry["target"]
+        if not post_url or post_url in seen or target in seen:
+            continue
+
+        selftext = entry["summary"].strip()
+        news_items.append(NewsItem(
+            title=entry["title"],
+            summary=selftext[:DEEP_CONTENT_CHARS] if selftext else "Reddit Discussion",
+            source=source["name"],
+            url=target or post_url,
+            published_ts=published_ts or now,
+            type=source["type"],
+            # Only external articles are deep-fetched; self posts already carry their text
+            deep_fetch=source["deep_fetch"] and bool(target),
+            weight=source["weight"],
+        ))
+
+    return fill_deep_content(news_items, deadline) if deep else news_items
+
+def reddit_link_target(url):
+    """The external article a Reddit link post points to, or None for Reddit-hosted media and self posts."""
+    if not url:
+        return None
+    host = urllib.parse.urlsplit(url).netloc.lower()
+    if not host or host.endswith(('reddit.com', 'redd.it')):
+        return None
+    return url
+
+def fetch_all_news(mode='all', deadline_s=INGEST_DEADLINE, sources=None, polled=None):
+    """Runs the RSS and Reddit fetchers for the mode's sources (or an explicit source list) side by
+    side under one shared deadline, merges copies of the same story, drops stories already sent in
+    the last 60 days, then deep-fetches only the surviving candidates. Sources fetched successfully
+    are added to the `polled` set, when given."""
+    deadline = time.monotonic() + deadline_s
+    cutoff = freshness_cutoff()
+    sources = sources or sources_for(mode)
+    with TracedExecutor(max_workers=2) as pool:
+        rss = pool.submit(fetch_rss_news, deadline, False, mode, sources, cutoff, polled)
+        reddit = pool.submit(fetch_reddit_news, deadline, False, mode, sources, cutoff, polled)
+        items = rss.result() + reddit.result()
+
+    store = get_seen_store()
+    candidates = [c for c in cluster_stories(items) if not store.seen_story(c.fingerprint)]
+    if len(candidates) < len(items):
+        print(f"🧬 Merged {len(items)} items into {len(candidates)} unique unseen stories")
+    return fill_deep_content(candidates, deadline)
+
+# --- Background Ingestion & Candidate Pool ---
+def due_sources(now=None):
+    """Registry sources whose poll interval has elapsed."""
+    with DB_LOCK:
+        polled = dict(get_db().execute("SELECT name, strftime('%s', last_polled) FROM source_polls").fetchall())
+    now = now or time.time()
+    return [src for src in sources_for('all')
+            if now - float(polled.get(src["name"]) or 0) >= src["poll_minutes"] * 60]
+
+@traced('db.load_candidate_pool')
+def load_candidate_pool(mode='all', hours=24):
+    """Unsent candidates from the pool published within the last `hours`, as NewsItems."""
+    query = ("SELECT url, title, summary, source, sources, alt_urls, type, weight, published_ts, fingerprint "
+             "FROM candidates WHERE published_ts >= ?")
+    params = [time.time() - hours * 3600]
+    if mode != 'all':
+        query += " AND type = ?"
+        params.append(mode)
+    with DB_LOCK:
+        rows = get_db().execute(query, params).fetchall()
+    store = get_seen_store()
+    items = []
+    for url, title, summary, source, sources, alt_urls, type_, weight, published_ts, fingerprint in rows:
+        fingerprint = fingerprint & 0xFFFFFFFFFFFFFFFF
+        if url in store or store.seen_story(fingerprint):
+            continue
+        items.append(NewsItem(title, summary, source, url, published_ts, type_, weight, deep_fetch=False,
+                              fingerprint=fingerprint, sources=json.loads(sources), alt_urls=json.loads(alt_urls)))
+    return items
+
+@traced('db.store_candidates')
+def store_candidates(items):
+    """Upserts fresh candidates into the pool. A story already pooled (same canonical URL or
+    near-duplicate fingerprint) gains the new sources instead of a second row."""
+    pool = load_candidate_pool('all', hours=CANDIDATE_RETENTION_HOURS)
+    by_url = {canonical_url(p.url): p for p in pool}
+    index = SimHashIndex()
+    for p in pool:
+        index.add(p.fingerprint, p)
+    rows = {}
+    for item in items:
+        existing = by_url.get(canonical_url(item.url)) or index.find(item.fingerprint)
+        if existing:
+            existing.sources = list(dict.fromkeys(existing.sources + (item.sources or [item.source])))
+            existing.alt_urls = [u for u in dict.fromkeys(existing.alt_urls + [item.url] + item.alt_urls)
+                                 if u != existing.url]
+            existing.weight = max(existing.weight, item.weight)
+            rows[existing.url] = existing
+        else:
+            by_url[canonical_url(item.url)] = item
+            index.add(item.fingerprint, item)
+            rows[item.url] = item
+    with DB_LOCK:
+        conn = get_db()
+        conn.executemany('''INSERT OR REPLACE INTO candidates (url, title, summary, source, sources, alt_urls, type,
+                              weight, published_at, published_ts, fingerprint, ingested_at)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE((SELECT ingested_at FROM candidates WHERE url = ?), CURRENT_TIMESTAMP))''',
+                         [(i.url, i.title, i.summary, i.source, json.dumps(i.sources or [i.source]),
+                           json.dumps(i.alt_urls), i.type, i.weight, i.published_at,
+                           i.published_ts, to_signed64(i.fingerprint), i.url) for i in rows.values()])
+        conn.execute("DELETE FROM candidates WHERE published_ts < ?", (time.time() - CANDIDATE_RETENTION_HOURS * 3600,))
+        conn.commit()
+    return len(rows)
+
+def ingest_once():
+    """Polls every due source once and stages its new candidates in the pool. Only sources that
+    were actually fetched count as polled, so a failed or skipped one keeps the pool cold."""
+    sources = due_sources()
+    if not sources:
+        return 0
+    print(f"🛰️ Ingesting {len(sources)} due source(s): {', '.join(s['name'] for s in sources)}")
+    polled = set()
+    items = fetch_all_news(sources=sources, polled=polled)
+    stored = store_candidates(items)
+    with DB_LOCK:
+        conn = get_db()
+        conn.executemany("INSERT OR REPLACE INTO source_polls (name, last_polled) VALUES (?, datetime('now'))",
+                         [(name,) for name in polled])
+        conn.commit()
+    print(f"🏊 Staged {stored} candidate(s) in the pool"
+          + (f" ({len(sources) - len(polled)} source(s) failed and stay due)" if len(polled) < len(sources) else ""))
+    return stored
+
+def candidate_pool_is_warm(mode):
+    """True when every source for the mode was polled within CANDIDATE_POOL_MAX_AGE_MINUTES."""
+    names = [s["name"] for s in sources_for(mode)]
+    if not names:
+        return False
+    placeholders = ",".join("?" * len(names))
+    with DB_LOCK:
+        (fresh,) = get_db().execute(
+            f"SELECT COUNT(*) FROM source_polls WHERE name IN ({placeholders}) AND last_polled >= datetime('now', ?)",
+            names + [f'-{CANDIDATE_POOL_MAX_AGE_MINUTES} minutes']).fetchone()
+    return fresh == len(names)
+
+def print_source_health():
+    """One line per source: latency percentiles, error streak, last entry count and breaker state."""
+    names = [src["name"] for src in sources_for('all', 'rss')] + ["Reddit"]
+    health = load_source_health(names)
+    now = time.time()
+    print(f"{'source':<24}{'p50':>7}{'p90':>7}{'timeout':>9}{'streak':>8}{'entries':>9}  state")
+    for src in sources_for('all', 'rss') + [dict(SOURCE_DEFAULTS, name="Reddit")]:
+        stats = health.get(src["name"])
+        if not stats:
+            print(f"{src['name'][:23]:<24}{'-':>7}{'-':>7}{src['timeout']:>8g}s{'-':>8}{'-':>9}  no data")
+            continue
+        p50, p90 = percentile(stats["latencies"], 0.5), percentile(stats["latencies"], 0.9)
+        if breaker_open(stats, now):
+            state = f"open for {(stats['open_until'] - now) / 60:.0f} min ({stats['last_error']})"
+        else:
+            state = f"failing: {stats['last_error']}" if stats["error_streak"] else "ok"
+        print(f"{src['name'][:23]:<24}{p50 or 0:>6.2f}s{p90 or 0:>6.2f}s{source_timeout(src, stats):>8.1f}s"
+              f"{stats['error_streak']:>8}{stats['last_count'] if stats['last_count'] is not None else '-':>9}  {state}")
+
+_ingest_lock = threading.Lock()
+
+def ingest_tick():
+    """One scheduler tick of background ingestion; skipped while the previous tick is still running."""
+    if not _ingest_lock.acquire(blocking=False):
+        return
+    try:
+        ingest_once()
+    except Exception as e:
+        print(f"⚠️ Ingestion Error: {e}")
+    finally:
+        _ingest_lock.release()
+
+def run_ingest_loop():
+    init_db()
+    print(f"🛰️ Continuous ingestion running (tick every {INGEST_TICK_SECONDS}s). Press Ctrl+C to stop.")
+    while True:
+        ingest_tick()
+        time.sleep(INGEST_TICK_SECONDS)
 
 def escape_markdown_v2(text):
     if not text: return ""
     return re.sub(r'([_*\[\]()~`>#+\-=|{}.!])', r'\\\1', text)
 
+# --- Candidate Ranking & Prompt Encoding ---
+def published_epoch(published_str, default=None):
+    """UTC epoch seconds for a feed date string (default: now)."""
+    if published_str:
+        try:
+            pub_date = parse_date(published_str)
+            if pub_date.tzinfo is None:
+                pub_date = pytz.utc.localize(pub_date)
+            return pub_date.timestamp()
+        except Exception:
+            pass
+    return time.time() if default is None else default
+
+def score_candidate(item, mode, now=None):
+    """Local relevance score: source weight, freshness, cross-source coverage and mode keywords."""
+    now = now or time.time()
+    age_hours = max(0.0, (now - item.published_ts) / 3600)
+    freshness = 0.5 ** (age_hours / FRESHNESS_HALF_LIFE_HOURS)
+    coverage = max(len(item.sources), 1) - 1
+    text = f"{item.title} {item.summary[:300]}".lower()
+    keywords = MODE_KEYWORDS.get(mode) or MODE_KEYWORDS['research'] + MODE_KEYWORDS['news']
+    hits = sum(1 for k in keywords if k in text)
+    return item.weight + freshness + 0.6 * min(coverage, 3) + 0.3 * min(hits, 3)
+
+@traced('rank.candidates')
+def rank_candidates(items, mode):
+    now = time.time()
+    return sorted(items, key=lambda item: score_candidate(item, mode, now), reverse=True)
+
+def _headline_words(title):
+    # Short and numeric tokens stay: "Gemini 3" and "Gemini 2.5", or "o3" and "o4", are different stories
+    return {w for w in re.findall(r"[a-z0-9]+(?:\.[0-9]+)*", (title or "").lower()) if w not in STOPWORDS}
+
+def _numbers(words):
+    return frozenset(w for w in words if any(c.isdigit() for c in w))
+
+def _summary_words(text):
+    return set(re.findall(r"[a-z0-9]+", (text or "").lower())[:ARCHIVE_DEDUP_SUMMARY_WORDS]) - STOPWORDS
+
+def _headline_similarity(a, b):
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+def _same_archived_story(words, item, sent):
+    """Title-word match plus a second signal, so a follow-up ("falls" vs "rises") is not dropped."""
+    sent_words, sent_fingerprint, sent_summary = sent
+    if _headline_similarity(words, sent_words) < ARCHIVE_DEDUP_JACCARD:
+        return False
+    if item.fingerprint is not None and sent_fingerprint is not None and \
+            bin(item.fingerprint ^ sent_fingerprint).count('1') <= SIMHASH_DISTANCE:
+        return True
+    summary = _summary_words(item.summary)
+    shorter = min(len(summary), len(sent_summary))
+    return shorter > 0 and len(summary & sent_summary) / shorter >= ARCHIVE_DEDUP_SUMMARY_OVERLAP
+
+@traced('dedup.archive')
+def drop_archived_stories(items, days=SEEN_RETENTION_DAYS, limit=ARCHIVE_DEDUP_CANDIDATES):
+    """Drops top-ranked candidates whose headline matches one already sent (per the digest archive)
+    within `days`, which catches a story re-reported under a new URL (see _same_archived_story)."""
+    since = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time() - days * 86400))
+    with DB_LOCK:
+        rows = get_db().execute("SELECT COALESCE(headline, title), fingerprint, summary FROM digest_items "
+                                "WHERE sent_at >= ?", (since,)).fetchall()
+    # (numbers, word) -> indexes of sent headlines, so each candidate is only compared with headlines
+    # that share a word and name exactly the same numbers
+    sent, sent_by_word = [], defaultdict(list)
+    for headline, fingerprint, summary in rows:
+        words = _headline_words(headline)
+        numbers = _numbers(words)
+        for w in words:
+            sent_by_word[numbers, w].append(len(sent))
+        sent.append((words, None if fingerprint is None else fingerprint & 0xFFFFFFFFFFFFFFFF,
+                     _summary_words(summary)))
+    kept, dropped = [], 0
+    for n, item in enumerate(items):
+        words = _headline_words(item.title)
+        numbers = _numbers(words)
+        if n < limit and len(words) >= 3 and any(
+                _same_archived_story(words, item, sent[i])
+                for i in {i for w in words for i in sent_by_word.get((numbers, w), ())}):
+            dropped += 1
+            continue
+        kept.append(item)
+    if dropped:
+        TRACE.incr('items.archive_duplicates', dropped)
+        print(f"🗄️ Dropped {dropped} stories already sent under another URL (digest archive)")
+    return kept
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token for English prose)."""
+    return len(text) // 4 + 1
+
+def _prompt_field(text):
+    return " ".join(str(text or "").replace("|", "/").split())
+
+def encode_candidates(items, token_budget=PROMPT_TOKEN_BUDGET):
+    """Packs ranked candidates into compact `id|type|sources|title|summary` rows until the estimated
+    token budget is used up. Returns (rows_text, included_items); row ids index included_items."""
+    rows, included, used = [], [], 0
+    max_summary_chars = PROMPT_SUMMARY_TOKENS * 4
+    for item in items:
+        summary = _prompt_field(item.summary)
+        if len(summary) > max_summary_chars:
+            summary = summary[:max_summary_chars].rsplit(' ', 1)[0] + "…"
+        sources = item.sources or [item.source]
+        source = _prompt_field(sources[0]) + (f" +{len(sources) - 1}" if len(sources) > 1 else "")
+        row = f"{len(included)}|{item.type}|{source}|{_prompt_field(item.title)}|{summary}"
+        cost = estimate_tokens(row)
+        if used + cost > token_budget:
+            break
+        rows.append(row)
+        included.append(item)
+        used += cost
+    return "\n".join(rows), included
+
+def resolve_digest_items(data, included):
+    """Maps the row ids Gemini returns back to the candidates' exact URLs, carrying along the
+    story fingerprint and alternate URLs needed to mark the story as sent."""
+    for item in data.get('items', []):
+        try:
+            candidate = included[int(item.get('id'))]
+        except (TypeError, ValueError, IndexError):
+            continue
+        item['url'] = candidate.url
+        item['fingerprint'] = candidate.fingerprint
+        item['alt_urls'] = candidate.alt_urls
+        item['headline'] = candidate.title
+        item.pop('id', None)
+    data['items'] = [item for item in data.get('items', []) if item.get('url')]
+    return data
+
 # --- AI Generation ---
-def generate_digest(news_items, mode):
-    if not GEMINI_API_KEY:
-        print("❌ Error: GEMINI_API_KEY is not set.")
-        return None
+class LLMRateLimitError(Exception):
+    """The model is rate limited, out of quota or overloaded. `retry_after` is the delay the server
+    asked for, in seconds, when it gave one."""
 
-    print(f"🤖 Generating digest for {len(news_items)} fresh items in '{mode}' mode using Gemini Native JSON...")
-    
-    try:
-        client = genai.Client(api_key=GEMINI_API_KEY)
-        ist = pytz.timezone('Asia/Kolkata')
-        today_str = datetime.now(ist).strftime("%B %d, %Y")
-        
-        system_instruction = f"""
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def gemini_retry_delay(error):
+    """The RetryInfo delay ("34s") from a Gemini API error, or the "retry in 34.5s" hint in its message."""
+    details = getattr(error, 'details', None)
+    if isinstance(details, dict):
+        for detail in details.get('error', details).get('details') or []:
+            match = re.fullmatch(r'([\d.]+)s', str(detail.get('retryDelay', '')))
+            if match:
+                return float(match.group(1))
+    match = re.search(r'retry in ([\d.]+)\s*s', str(error), re.IGNORECASE)
+    return float(match.group(1)) if match else None
+
+class GeminiBackend:
+    """LLM backend interface: generate(prompt, model, temperature) returns the JSON response text and
+    raises LLMRateLimitError when the model is rate limited. One client per process."""
+
+    def __init__(self, api_key=None):
+        self.api_key = api_key
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from google import genai
+                self._client = genai.Client(api_key=self.api_key or GEMINI_API_KEY)
+            return self._client
+
+    def generate(self, prompt, model, temperature):
+        from google.genai import errors, types
+        try:
+            response = self.client.models.generate_content(
+                model=model,
+                contents=prompt,
+                config=types.GenerateContentConfig(
+                    response_mime_type="application/json",
+                    temperature=temperature
+                )
+            )
+        except errors.APIError as e:
+            if e.code in (429, 503):
+                raise LLMRateLimitError(f"{model}: {e.code} {e.status}", gemini_retry_delay(e)) from e
+            raise
+        usage = getattr(response, 'usage_metadata', None)
+        if usage:
+            TRACE.incr('llm.prompt_tokens', getattr(usage, 'prompt_token_count', 0) or 0)
+            TRACE.incr('llm.output_tokens', getattr(usage, 'candidates_token_count', 0) or 0)
+        return response.text
+
+_hedge_pool = None
+_hedge_pool_lock = threading.Lock()
+
+def _hedge_executor():
+    global _hedge_pool
+    with _hedge_pool_lock:
+        if _hedge_pool is None:
+            _hedge_pool = TracedExecutor(max_workers=LLM_CONCURRENCY * 2, thread_name_prefix="llm")
+        return _hedge_pool
+
+class LLMClient:
+    """The callable generate_digest uses: prompt in, JSON text out. Adds the llm_cache, retries that
+    honour the server's retry delay, fallback down `models` when quota runs out, and optional
+    hedging. `backend` is anything with GeminiBackend's generate() (a local stub works offline)."""
+
+    def __init__(self, backend, models=None, temperature=GEMINI_TEMPERATURE, hedge_after=None, cache=True):
+        self.backend = backend
+        self.models = models or [GEMINI_MODEL] + [m for m in GEMINI_FALLBACK_MODELS if m != GEMINI_MODEL]
+        self.temperature = temperature
+        self.hedge_after = LLM_HEDGE_AFTER if hedge_after is None else hedge_after
+        self.cache = cache
+
+    def __call__(self, prompt):
+        key = llm_cache_key(prompt, self.models[0], self.temperature)
+        if self.cache:
+            cached = load_llm_response(key)
+            if cached is not None:
+                TRACE.incr('llm_cache.hits')
+                print("♻️ Reusing cached Gemini response")
+                return cached
+            TRACE.incr('llm_cache.misses')
+        for n, model in enumerate(self.models):
+            try:
+                text = self._generate(prompt, model, last_model=n == len(self.models) - 1)
+            except LLMRateLimitError as e:
+                if n == len(self.models) - 1:
+                    raise
+                TRACE.incr('llm.fallbacks')
+                print(f"⚠️ {e}; falling back to {self.models[n + 1]}")
+                continue
+            if self.cache and text:
+                save_llm_response(key, model, text)
+            return text
+
+    def _generate(self, prompt, model, last_model):
+        for attempt in range(LLM_MAX_ATTEMPTS):
+            try:
+                return self._hedged(prompt, model)
+            except LLMRateLimitError as e:
+                delay = e.retry_after
+                if delay is None and last_model:
+                    # Nothing to fall back to and no hint from the server: the old fixed backoff
+                    delay = LLM_DEFAULT_RETRY_DELAY * (attempt + 1)
+                if delay is None or delay > LLM_MAX_RETRY_DELAY or attempt == LLM_MAX_ATTEMPTS - 1:
+                    raise
+                TRACE.incr('llm.retries')
+                print(f"⚠️ {model} rate limited (429). Retrying in {delay:g}s...")
+                with TRACE.span('llm.backoff'):
+                    time.sleep(delay)
+
+    def _attempt(self, prompt, model):
+        with TRACE.span('llm.attempt'):
+            return self.backend.generate(prompt, model, self.temperature)
+
+    def _hedged(self, prompt, model):
+        if self.hedge_after <= 0:
+            return self._attempt(prompt, model)
+        pool = _hedge_executor()
+        first = pool.submit(self._attempt, prompt, model)
+        done, _ = wait([first], timeout=self.hedge_after)
+        if done:
+            return first.result()
+        TRACE.incr('llm.hedged')
+        second = pool.submit(self._attempt, prompt, model)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when='FIRST_COMPLETED')
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        TRACE.incr('llm.hedge_wins')
+                    return future.result()
+                error = future.exception()
+        raise error
+
+_llm_client = None
+
+def get_llm_client():
+    """The process-wide Gemini LLMClient (the daemon keeps its connection warm between runs)."""
+    global _llm_client
+    if _llm_client is None:
+        _llm_client = LLMClient(GeminiBackend())
+    return _llm_client
+
+def gemini_generate(prompt):
+    """One digest/shortlist call through the shared Gemini client. Returns the response text (or None)."""
+    return get_llm_client()(prompt)
+
+def _prompt_header(mode):
+    ist = pytz.timezone('Asia/Kolkata')
+    today_str = datetime.now(ist).strftime("%B %d, %Y")
+    return f"""
         You are Tech News by VJ, an AI-powered daily tech news curator for @technewsbyvj.
         Today is {today_str}. Current Mode: {mode.upper()}
         """
 
-        task_instruction = f"""
-        INPUT DATA:
-        {json.dumps({"items": news_items}, indent=2)}
-        
-        TASK:
-        Select the best 5-10 items to create a highly curated tech digest.
-        All provided input items are fresh and unseen.
-        """
-
-        if mode == 'research':
-            task_instruction += """
+def _mode_priority(mode):
+    if mode == 'research':
+        return """
         RESEARCH PRIORITY (Arxiv, HuggingFace, DeepMind, OpenAI):
         - Focus heavily on new models, training techniques, and genuine AI breakthroughs.
         - Exclude minor github commits or trivial code drops.
         - Only select items with type="research" or heavily related to AI research.
             """
-        elif mode == 'news':
-            task_instruction += """
+    if mode == 'news':
+        return """
         NEWS PRIORITY (TechCrunch, Verge, VC, Corporate):
         - Focus on product launches, massive funding rounds, policy changes, and major corporate shifts.
         - Only select items with type="news" or related to tech industry movements.
             """
+    return ""
 
-        task_instruction += """
+def _input_block(rows):
+    return f"""
+        INPUT DATA (one candidate per line, ranked best-first; "+N" after a source means N other outlets covered it):
+        id|type|source|title|summary
+        {rows}
+        """
+
+def build_digest_prompt(rows, mode):
+    task_instruction = _input_block(rows) + """
+        TASK:
+        Select the best 5-10 items to create a highly curated tech digest.
+        All provided input items are fresh and unseen.
+        """ + _mode_priority(mode) + """
         CONTENT STYLE:
         - Summaries must be extremely concise (strictly under 25 words), factual, and punchy.
         - Source names should be clean (e.g., 'Ars Technica' not 'Ars Technica Feed').
@@ -266,42 +2050,98 @@ def generate_digest(news_items, mode):
               "title": "Cleaned Headline String",
               "summary": "25-word punchy summary string",
               "source": "Clean Source Name",
-              "url": "Exact URL provided"
+              "id": 0
             }
           ]
         }
+        The "id" must be the exact id of the chosen input line.
         """
-        
-        prompt = system_instruction + task_instruction
-        
-        response = None
-        for attempt in range(3):
-            try:
-                response = client.models.generate_content(
-                    model='gemini-2.5-flash',
-                    contents=prompt,
-                    config=genai.types.GenerateContentConfig(
-                        response_mime_type="application/json",
-                        temperature=0.3
-                    )
-                )
-                break
-            except Exception as e:
-                err_str = str(e)
-                if "429" in err_str or "RESOURCE_EXHAUSTED" in err_str or "Quota" in err_str:
-                    if attempt < 2:
-                        wait_time = (attempt + 1) * 20
-                        print(f"⚠️ Quota exceeded (429). Retrying in {wait_time}s...")
-                        time.sleep(wait_time)
-                    else:
-                        raise e
-                else:
-                    raise e
-                    
-        if not response:
+    return _prompt_header(mode) + task_instruction
+
+def build_shortlist_prompt(rows, mode, size):
+    return _prompt_header(mode) + _input_block(rows) + f"""
+        TASK:
+        This is one shard of a larger candidate pool. Shortlist up to {size} items from it that
+        deserve a place in today's highly curated tech digest, best first.
+        """ + _mode_priority(mode) + """
+        JSON SCHEMA REQUIRED:
+        {"ids": [0, 3, 7]}
+        """
+
+def _shortlist_shard(shard, mode, llm):
+    """Map step for one shard: returns the shortlisted candidates, best first.
+    Retries with backoff; if every attempt fails the shard keeps its locally top-ranked items."""
+    rows, included = encode_candidates(shard, SHARD_TOKEN_BUDGET)
+    prompt = build_shortlist_prompt(rows, mode, SHORTLIST_PER_SHARD)
+    for attempt in range(LLM_SHARD_RETRIES + 1):
+        try:
+            picked = []
+            for i in json.loads(llm(prompt) or "{}").get("ids", []):
+                i = int(i)
+                if 0 <= i < len(included) and i not in picked:
+                    picked.append(i)
+            return [included[i] for i in picked[:SHORTLIST_PER_SHARD]]
+        except Exception as e:
+            if attempt < LLM_SHARD_RETRIES:
+                time.sleep(2 ** attempt)
+            else:
+                print(f"⚠️ Shard shortlist failed ({e}); keeping its top local picks")
+    return included[:SHORTLIST_PER_SHARD]
+
+@traced('llm.shortlist')
+def shortlist_candidates(news_items, mode, llm):
+    """Map-reduce pre-selection for pools too large for one prompt: ranked candidates are dealt
+    round-robin into shards that each fit SHARD_TOKEN_BUDGET, shards are shortlisted by concurrent
+    LLM calls (at most LLM_CONCURRENCY in flight), and the merged shortlist is reduced again until
+    it fits the final prompt. Returns candidates in their original rank order."""
+    rank = {id(item): i for i, item in enumerate(news_items)}
+    candidates = news_items
+    level = 0
+    while True:
+        total = estimate_tokens(encode_candidates(candidates, float('inf'))[0])
+        if total <= PROMPT_TOKEN_BUDGET:
+            break
+        n_shards = max(2, -(-total // SHARD_TOKEN_BUDGET))
+        shards = [candidates[i::n_shards] for i in range(n_shards)]
+        level += 1
+        print(f"🗺️ Map-reduce level {level}: {len(candidates)} candidates in {n_shards} shards")
+        with TracedExecutor(max_workers=LLM_CONCURRENCY) as pool:
+            shortlists = list(pool.map(lambda shard: _shortlist_shard(shard, mode, llm), shards))
+        merged = sorted({id(c): c for sl in shortlists for c in sl}.values(), key=lambda c: rank[id(c)])
+        if len(merged) >= len(candidates):
+            break
+        candidates = merged
+    return candidates
+
+def generate_digest(news_items, mode, llm=None):
+    """Selects and rewrites the digest. `llm` is any callable taking a prompt and returning the
+    JSON response text; it defaults to Gemini (a stub can be passed for offline runs)."""
+    if llm is None:
+        if not GEMINI_API_KEY:
+            print("❌ Error: GEMINI_API_KEY is not set.")
+            return None
+        llm = gemini_generate
+
+    try:
+        candidates = shortlist_candidates(news_items, mode, llm)
+        rows, included = encode_candidates(candidates)
+        print(f"🤖 Generating digest for {len(included)}/{len(news_items)} fresh items "
+              f"(~{estimate_tokens(rows)} tokens) in '{mode}' mode using Gemini Native JSON...")
+
+        TRACE.incr('items.prompted', len(included))
+        TRACE.incr('prompt.estimated_tokens', estimate_tokens(rows))
+        prompt = build_digest_prompt(rows, mode)
+        with TRACE.span('llm.digest'):
+            text = llm(prompt)
+        if not text:
              return None
              
-        data = json.loads(response.text)
+        data = resolve_digest_items(json.loads(text), included)
+        # Same candidates + same prompt => same ID, so a retried run replaces rather than duplicates
+        digest_id = llm_cache_key(prompt)[:12]
+        data['digest_id'] = digest_id
+        save_digest(digest_id, mode, data)
+        print(f"🧾 Digest ID: {digest_id} (replay with --replay {digest_id})")
         return data
         
     except Exception as e:
@@ -311,152 +2151,157 @@ def generate_digest(news_items, mode):
         return None
 
 # --- Output Formatting & Sending ---
-def format_telegram_digest(data, mode):
-    ist = pytz.timezone('Asia/Kolkata')
-    today_str = datetime.now(ist).strftime("%B %d, %Y")
-    now_hour = datetime.now(ist).hour
-    
-    header_date = escape_markdown_v2(today_str)
-    greeting = "🌅 *GM*" if now_hour < 12 else "☕ *Good Afternoon*"
-    
-    topic_header = "🗞️ *TECH DIGEST*"
-    if mode == 'research': topic_header = "🔬 *RESEARCH & AI PAPERS*"
-    elif mode == 'news': topic_header = "📰 *TECH NEWS & UPDATES*"
+@dataclass(slots=True)
+class DigestIR:
+    """A digest resolved once for every channel: header fields and (icon, title, summary, source, url)
+    items. Channels render it to blocks (header, one per item, footer) that are joined with blank lines."""
+    greeting: str
+    topic: str
+    date: str
+    items: list
 
-    msg = f"{greeting} — {topic_header}\n{header_date}\n\n"
-    
-    items = data.get('items', [])
-    if not items:
-        msg += "_(No massive updates found at this time)_\n\n"
-        
-    for i, item in enumerate(items):
-        title = escape_markdown_v2(item.get('title', 'Untitled'))
-        summary = escape_markdown_v2(item.get('summary', ''))
-        source = escape_markdown_v2(item.get('source', 'Source'))
+TOPIC_HEADERS = {"research": "🔬 *RESEARCH & AI PAPERS*", "news": "📰 *TECH NEWS & UPDATES*"}
+
+def digest_ir(data, mode, now=None):
+    now = now or datetime.now(pytz.timezone('Asia/Kolkata'))
+    items = []
+    for item in data.get('items', []):
         url = item.get('url', '')
         if not url.startswith('http'): url = 'https://google.com'
-            
-        type_icon = escape_markdown_v2(item.get('type', '🔹'))
-        msg += f"{i+1}\\. {type_icon} *{title}*\n{summary}\n📎 [{source}]({url})\n\n"
-        
-    msg += "━━━━━━━━━━━━━━━━━━━━\n🤖 _Tech News by VJ_"
-    return msg
+        items.append((item.get('type', '🔹'), item.get('title', 'Untitled'), item.get('summary', ''),
+                      item.get('source', 'Source'), url))
+    return DigestIR(greeting="🌅 *GM*" if now.hour < 12 else "☕ *Good Afternoon*",
+                    topic=TOPIC_HEADERS.get(mode, "🗞️ *TECH DIGEST*"),
+                    date=now.strftime("%B %d, %Y"), items=items)
+
+def render_digest(ir, channel):
+    """The digest as a list of blocks for `channel` ("telegram" is MarkdownV2, "whatsapp" plain)."""
+    telegram = channel == "telegram"
+    esc = escape_markdown_v2 if telegram else str
+    blocks = [f"{ir.greeting} — {ir.topic}\n{esc(ir.date)}"]
+    if not ir.items:
+        blocks.append("_(No massive updates found at this time)_")
+    for i, (icon, title, summary, source, url) in enumerate(ir.items):
+        if telegram:
+            blocks.append(f"{i+1}\\. {esc(icon)} *{esc(title)}*\n{esc(summary)}\n📎 [{esc(source)}]({url})")
+        else:
+            blocks.append(f"{i+1}. {icon} *{title.replace('*', '')}*\n{summary}\n📎 {source}: {url}")
+    blocks.append("━━━━━━━━━━━━━━━━━━━━\n🤖 _Tech News by VJ_")
+    return blocks
+
+def format_telegram_digest(data, mode):
+    return "\n\n".join(render_digest(digest_ir(data, mode), "telegram"))
 
 def format_whatsapp_digest(data, mode):
-    ist = pytz.timezone('Asia/Kolkata')
-    today_str = datetime.now(ist).strftime("%B %d, %Y")
-    now_hour = datetime.now(ist).hour
-    
-    greeting = "🌅 *GM*" if now_hour < 12 else "☕ *Good Afternoon*"
-    
-    topic_header = "🗞️ *TECH DIGEST*"
-    if mode == 'research': topic_header = "🔬 *RESEARCH & AI PAPERS*"
-    elif mode == 'news': topic_header = "📰 *TECH NEWS & UPDATES*"
+    return "\n\n".join(render_digest(digest_ir(data, mode), "whatsapp"))
 
-    msg = f"{greeting} — {topic_header}\n{today_str}\n\n"
-    
-    items = data.get('items', [])
-    if not items:
-        msg += "_(No massive updates found at this time)_\n\n"
-        
-    for i, item in enumerate(items):
-        title = item.get('title', 'Untitled').replace('*', '')
-        summary = item.get('summary', '')
-        source = item.get('source', 'Source')
-        url = item.get('url', '')
-        if not url.startswith('http'): url = 'https://google.com'
-            
-        type_icon = item.get('type', '🔹')
-        msg += f"{i+1}. {type_icon} *{title}*\n{summary}\n📎 {source}: {url}\n\n"
-        
-    msg += "━━━━━━━━━━━━━━━━━━━━\n🤖 _Tech News by VJ_"
-    return msg
+def _share_cost(text):
+    return len(urllib.parse.quote(text))
 
-def send_telegram_message(message, reply_markup=None):
-    if not BOT_TOKEN or not CHAT_ID:
-        print("❌ Telegram config missing.")
-        return False
+def _split_block(block, limit, cost):
+    """Cuts one block that alone exceeds `limit` at line breaks, then at spaces, then anywhere."""
+    pieces, current = [], ""
+    for unit in re.findall(r"[^\n]*\n|[^\n]+", block):
+        if cost(current + unit) <= limit:
+            current += unit
+            continue
+        if current.strip():
+            pieces.append(current.rstrip("\n"))
+        current = unit
+        while cost(current) > limit:
+            lo, hi = 1, len(current)  # longest prefix within the limit
+            while lo < hi:
+                mid = (lo + hi + 1) // 2
+                lo, hi = (mid, hi) if cost(current[:mid]) <= limit else (lo, mid - 1)
+            space = current.rfind(" ", 0, lo)
+            cut = space + 1 if space > 0 else lo
+            # Never end a piece on a MarkdownV2 escape backslash
+            while cut > 1 and current[cut - 1] == "\\":
+                cut -= 1
+            if current[:cut].strip():
+                pieces.append(current[:cut].rstrip())
+            current = current[cut:]
+    if current.strip():
+        pieces.append(current.rstrip("\n"))
+    return pieces
 
-    max_length = 4000
-    messages = []
-    if len(message) > max_length:
-        parts = message.split('\n\n')
-        current_chunk = ""
-        for part in parts:
-             if len(current_chunk) + len(part) + 2 > max_length:
-                 messages.append(current_chunk)
-                 current_chunk = part + "\n\n"
-             else:
-                 current_chunk += part + "\n\n"
-        if current_chunk: messages.append(current_chunk)
-    else:
-        messages = [message]
-
-    success = True
+def chunk_blocks(blocks, limit, cost=len, sep="\n\n"):
+    """Packs blocks into as few chunks as fit `limit` (measured by `cost`, e.g. len or the URL-encoded
+    length), in one pass and splitting only between blocks; a block over the limit on its own is cut
+    at line breaks. Never returns an empty chunk."""
+    sep_cost = cost(sep)
+    chunks, current, used = [], [], 0
+    for block in blocks:
+        if not block.strip():
+            continue
+        pieces = _split_block(block, limit, cost) if cost(block) > limit else [block]
+        for piece in pieces:
+            size = cost(piece)
+            if current and used + sep_cost + size > limit:
+                chunks.append(sep.join(current))
+                current, used = [], 0
+            used += size + (sep_cost if current else 0)
+            current.append(piece)
+    if current:
+        chunks.append(sep.join(current))
+    return chunks
+
+def _message_blocks(message):
+    # A pre-rendered digest string splits back into blocks at its blank lines
+    return message if isinstance(message, list) else message.split("\n\n")
+
+def share_buttons(wa_blocks):
+    """"Prepare WhatsApp Post" buttons prefilled with the digest, one per part that fits WA_SHARE_URL_MAX."""
+    parts = chunk_blocks(wa_blocks, WA_SHARE_URL_MAX - len(WA_SHARE_URL), cost=_share_cost)
+    return [[{"text": "🚀 Prepare WhatsApp Post" + (f" ({i + 1}/{len(parts)})" if len(parts) > 1 else ""),
+              "url": WA_SHARE_URL + urllib.parse.quote(part)}] for i, part in enumerate(parts)]
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def http_session(name):
+    """A pooled keep-alive requests.Session per API (telegram, whatsapp, ...), reused for the whole process."""
+    with _sessions_lock:
+        session = _sessions.get(name)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[name] = session
+        return session
+
+def telegram_payloads(message, reply_markup=None):
+    """`message` is a rendered digest: a list of blocks, or a string split at its blank lines."""
+    messages = chunk_blocks(_message_blocks(message), TELEGRAM_MAX_CHARS)
+    payloads = []
     for i, msg in enumerate(messages):
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
         payload = {
             'chat_id': CHAT_ID,
             'text': msg,
             'parse_mode': 'MarkdownV2',
             'disable_web_page_preview': True
         }
-        
         # Only add markup to the last part (or the only part)
         if i == len(messages) - 1 and reply_markup:
             payload['reply_markup'] = reply_markup
+        payloads.append(payload)
+    return payloads
 
-        try:
-            r = requests.post(url, json=payload, timeout=20)
-            if r.status_code == 200:
-                print(f"✅ Telegram part {i+1}/{len(messages)} sent")
-            else:
-                print(f"❌ Telegram Send Failed: {r.status_code} - {r.text}")
-                success = False
-        except Exception as e:
-            print(f"⚠️ Telegram Error: {e}")
-            success = False
-    return success
-
-def send_whatsapp_message(message):
-    if not WHATSAPP_TOKEN or not WHATSAPP_PHONE_ID or not WHATSAPP_RECIPIENT:
-        print("❌ WhatsApp config missing. Skipping.")
-        return False
-
+def clean_phone_number(number):
     # Meta strictly requires no '+', spaces, or dashes in the recipient number
-    clean_recipient = WHATSAPP_RECIPIENT.replace('+', '').replace('-', '').replace(' ', '').strip()
-    template_name = os.getenv('WHATSAPP_TEMPLATE_NAME')
-
-    url = f"https://graph.facebook.com/v22.0/{WHATSAPP_PHONE_ID}/messages"
-    headers = {'Authorization': f'Bearer {WHATSAPP_TOKEN}', 'Content-Type': 'application/json'}
+    return number.replace('+', '').replace('-', '').replace(' ', '').strip()
 
+def whatsapp_payloads(message, recipient, template_name=None):
     # WhatsApp allows 4000 chars for free-form text, but Meta templates strictly limit variables to 1024 chars.
-    limit = 1024 if template_name else 4000
-    
-    messages = []
-    if len(message) > limit:
-        # Split by items (denoted by \n\n)
-        parts = message.split('\n\n')
-        current_chunk = ""
-        for part in parts:
-             if len(current_chunk) + len(part) + 2 > limit:
-                 if current_chunk:
-                     messages.append(current_chunk.strip())
-                 current_chunk = part + "\n\n"
-             else:
-                 current_chunk += part + "\n\n"
-        if current_chunk:
-            messages.append(current_chunk.strip())
-    else:
-        messages = [message]
-
-    success = True
-    for i, msg_part in enumerate(messages):
+    limit = WHATSAPP_TEMPLATE_VAR_CHARS if template_name else WHATSAPP_MAX_CHARS
+    payloads = []
+    for msg_part in chunk_blocks(_message_blocks(message), limit):
         # Default payload (Text mode - requires 24h interaction)
         payload = {
             "messaging_product": "whatsapp",
             "recipient_type": "individual",
-            "to": clean_recipient,
+            "to": recipient,
             "type": "text",
             "text": {
                 "body": msg_part,
@@ -468,104 +2313,588 @@ def send_whatsapp_message(message):
         if template_name:
             payload = {
                 "messaging_product": "whatsapp",
-                "to": clean_recipient,
+                "to": recipient,
                 "type": "template",
                 "template": {
                     "name": template_name,
                     "language": {"code": "en_US"},
                     "components": [{
                         "type": "body",
-                        "parameters": [{"type": "text", "text": msg_part[:1024]}] # FB Templates limit vars to 1024 chars
+                        "parameters": [{"type": "text", "text": msg_part}]
                     }]
                 }
             }
+        payloads.append(payload)
+    return payloads
+
+# --- Durable Delivery Outbox ---
+# Every chunk is written to the outbox before it is sent. Channels drain in parallel, each strictly
+# in order; a crashed or failed run leaves the unsent rows pending and the next run resumes them.
+@traced('db.enqueue_outbox')
+def enqueue_outbox(digest_id, channel, payloads):
+    """Queues a digest's chunks. Chunks already sent for this digest stay sent; failed or expired
+    ones are re-armed, so re-running the same digest only sends what is missing."""
+    with DB_LOCK:
+        conn = get_db()
+        conn.executemany('''INSERT INTO outbox (digest_id, channel, seq, payload) VALUES (?, ?, ?, ?)
+                              ON CONFLICT (digest_id, channel, seq) DO UPDATE SET payload = excluded.payload,
+                              status = 'pending', created_at = CURRENT_TIMESTAMP WHERE outbox.status != 'sent' ''',
+                         [(digest_id, channel, seq, json.dumps(p)) for seq, p in enumerate(payloads)])
+        conn.commit()
 
+def reset_outbox(digest_id):
+    with DB_LOCK:
+        conn = get_db()
+        conn.execute("DELETE FROM outbox WHERE digest_id = ?", (digest_id,))
+        conn.commit()
+
+@traced('db.pending_outbox')
+def pending_outbox(channel=None):
+    """Pending rows (id, digest_id, channel, seq, payload, attempts) in send order."""
+    query = "SELECT id, digest_id, channel, seq, payload, attempts FROM outbox WHERE status = 'pending'"
+    params = ()
+    if channel:
+        query += " AND channel = ?"
+        params = (channel,)
+    with DB_LOCK:
+        return get_db().execute(query + " ORDER BY created_at, digest_id, seq", params).fetchall()
+
+def _mark_outbox(row_id, status, error=None):
+    with DB_LOCK:
+        conn = get_db()
+        conn.execute('''UPDATE outbox SET status = ?, attempts = attempts + 1, last_error = ?,
+                          sent_at = CASE WHEN ? = 'sent' THEN CURRENT_TIMESTAMP ELSE sent_at END WHERE id = ?''',
+                     (status, error, status, row_id))
+        conn.commit()
+
+@traced('send.telegram')
+def _telegram_send(payload):
+    """Returns (ok, retry_after_seconds, error)."""
+    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+    r = http_session('telegram').post(url, json=payload, timeout=20)
+    if r.status_code == 200:
+        return True, None, None
+    retry_after = None
+    if r.status_code == 429 or r.status_code >= 500:
         try:
-            r = requests.post(url, headers=headers, json=payload, timeout=20)
-            if r.status_code in [200, 201]:
-                print(f"✅ WhatsApp part {i+1}/{len(messages)} sent via {'Template' if template_name else 'Text'}")
-            else:
-                resp_json = r.json()
-                err_code = resp_json.get('error', {}).get('code')
-                
-                print(f"❌ WhatsApp Send Failed: {r.status_code} - {r.text}")
-                
-                if err_code == 131047:
-                    print("\n⚠️ ISSUE: The 24-hour session window has closed.")
-                    print("   To fix:")
-                    print("   1. Send any message from your phone TO the bot's WhatsApp number to re-open the window.")
-                    print("   2. OR create an approved template in Meta Developer Console, and set WHATSAPP_TEMPLATE_NAME in your .env file.\n")
-                success = False
-        except Exception as e:
-            print(f"⚠️ WhatsApp Error: {e}")
-            success = False
-    return success
+            retry_after = r.json().get('parameters', {}).get('retry_after')
+        except ValueError:
+            pass
+        retry_after = retry_after or float(r.headers.get('Retry-After', 0)) or None
+        if retry_after is None:
+            retry_after = DELIVERY_BACKOFF
+    return False, retry_after, f"{r.status_code} - {r.text}"
+
+# Meta throughput errors: 4 (app rate limit), 80007 (WABA rate limit), 130429 (throughput), 131056 (pair rate limit)
+WHATSAPP_THROTTLE_CODES = {4, 80007, 130429, 131056}
+
+# 131047: the 24-hour customer service window is closed; only template messages get through
+WHATSAPP_WINDOW_CLOSED = 131047
+
+@traced('send.whatsapp')
+def _whatsapp_post(payload):
+    """Returns (ok, retry_after_seconds, error, error_code)."""
+    url = f"{WHATSAPP_GRAPH_URL}/{WHATSAPP_PHONE_ID}/messages"
+    headers = {'Authorization': f'Bearer {WHATSAPP_TOKEN}', 'Content-Type': 'application/json'}
+    r = http_session('whatsapp').post(url, headers=headers, json=payload, timeout=20)
+    if r.status_code in [200, 201]:
+        return True, None, None, None
+    try:
+        err_code = r.json().get('error', {}).get('code')
+    except ValueError:
+        err_code = None
+    retry_after = None
+    if r.status_code == 429 or r.status_code >= 500 or err_code in WHATSAPP_THROTTLE_CODES:
+        retry_after = float(r.headers.get('Retry-After', 0)) or DELIVERY_BACKOFF
+    return False, retry_after, f"{r.status_code} - {r.text}", err_code
+
+def _whatsapp_send(payload):
+    """Returns (ok, retry_after_seconds, error)."""
+    ok, retry_after, error, err_code = _whatsapp_post(payload)
+    if err_code == WHATSAPP_WINDOW_CLOSED:
+        print("\n⚠️ ISSUE: The 24-hour session window has closed.")
+        print("   To fix:")
+        print("   1. Send any message from your phone TO the bot's WhatsApp number to re-open the window.")
+        print("   2. OR create an approved template in Meta Developer Console, and set WHATSAPP_TEMPLATE_NAME in your .env file.\n")
+    return ok, retry_after, error
+
+CHANNEL_SENDERS = {
+    "telegram": _telegram_send,
+    "whatsapp": _whatsapp_send,
+}
+CHANNEL_LABELS = {"telegram": "Telegram", "whatsapp": "WhatsApp"}
+
+def drain_outbox(channel):
+    """Sends the channel's pending rows in order. Rate-limited chunks are retried after the delay the
+    API asked for; the channel stops at the first hard failure so later chunks never overtake it."""
+    send = CHANNEL_SENDERS[channel]
+    label = CHANNEL_LABELS.get(channel, channel)
+    interval = {"telegram": TELEGRAM_MIN_INTERVAL, "whatsapp": WHATSAPP_MIN_INTERVAL}.get(channel, 0)
+    for n, (row_id, digest_id, _, seq, payload, attempts) in enumerate(pending_outbox(channel)):
+        if n:
+            time.sleep(interval)
+        payload = json.loads(payload)
+        while True:
+            try:
+                ok, retry_after, error = send(payload)
+            except Exception as e:
+                ok, retry_after, error = False, DELIVERY_BACKOFF, str(e)
+            attempts += 1
+            if ok:
+                TRACE.incr(f'send.{channel}.sent')
+                _mark_outbox(row_id, 'sent')
+                print(f"✅ {label} part {seq + 1} of digest {digest_id} sent")
+                break
+            if retry_after is not None and attempts < DELIVERY_MAX_ATTEMPTS:
+                TRACE.incr(f'send.{channel}.retries')
+                print(f"⏳ {label} rate limited; retrying part {seq + 1} in {float(retry_after):g}s")
+                _mark_outbox(row_id, 'pending', error)
+                time.sleep(min(float(retry_after), DELIVERY_MAX_BACKOFF))
+                continue
+            print(f"❌ {label} Send Failed: {error}")
+            _mark_outbox(row_id, 'pending' if retry_after is not None else 'failed', error)
+            if retry_after is None:
+                # Later chunks must not overtake this one on a future resume
+                with DB_LOCK:
+                    conn = get_db()
+                    conn.execute("UPDATE outbox SET status = 'failed' WHERE digest_id = ? AND channel = ? AND seq > ? AND status = 'pending'",
+                                 (digest_id, channel, seq))
+                    conn.commit()
+            return False
+    return True
+
+def deliver_channels(channels):
+    """Drains several channels concurrently; returns {channel: all_sent}."""
+    if not channels:
+        return {}
+    with TracedExecutor(max_workers=len(channels)) as pool:
+        return dict(zip(channels, pool.map(drain_outbox, channels)))
+
+def resume_outbox():
+    """Finishes sends a previous run left pending (within OUTBOX_RESUME_HOURS); older rows expire."""
+    with DB_LOCK:
+        conn = get_db()
+        conn.execute("UPDATE outbox SET status = 'expired' WHERE status = 'pending' AND created_at < datetime('now', ?)",
+                     (f'-{OUTBOX_RESUME_HOURS} hours',))
+        conn.commit()
+    pending = pending_outbox()
+    channels = sorted({row[2] for row in pending} & set(CHANNEL_SENDERS))
+    if not channels:
+        return
+    print(f"📤 Resuming unsent outbox parts for: {', '.join(channels)}")
+    deliver_channels(channels)
+    # A digest counts as delivered once any one channel has sent all of its parts, as in deliver_digest
+    for digest_id in sorted({row[1] for row in pending}):
+        with DB_LOCK:
+            done = get_db().execute("SELECT 1 FROM outbox WHERE digest_id = ? GROUP BY channel "
+                                    "HAVING SUM(status != 'sent') = 0 LIMIT 1", (digest_id,)).fetchone()
+        mode, data = load_digest(digest_id)
+        if done and data is not None:
+            record_sent_digest(data, mode)
+
+def _message_id(message):
+    return hashlib.sha256("\n\n".join(_message_blocks(message)).encode()).hexdigest()[:12]
+
+def send_telegram_message(message, reply_markup=None, digest_id=None):
+    if not BOT_TOKEN or not CHAT_ID:
+        print("❌ Telegram config missing.")
+        return False
+    enqueue_outbox(digest_id or _message_id(message), "telegram", telegram_payloads(message, reply_markup))
+    return drain_outbox("telegram")
+
+def send_whatsapp_message(message, digest_id=None):
+    if WHATSAPP_TOKEN and WHATSAPP_PHONE_ID and active_recipients():
+        return broadcast_whatsapp(message, digest_id or _message_id(message))
+    if not WHATSAPP_TOKEN or not WHATSAPP_PHONE_ID or not WHATSAPP_RECIPIENT:
+        print("❌ WhatsApp config missing. Skipping.")
+        return False
+    payloads = whatsapp_payloads(message, clean_phone_number(WHATSAPP_RECIPIENT), os.getenv('WHATSAPP_TEMPLATE_NAME'))
+    enqueue_outbox(digest_id or _message_id(message), "whatsapp", payloads)
+    return drain_outbox("whatsapp")
+
+# --- WhatsApp Broadcast ---
+class TokenBucket:
+    """Thread-safe token bucket: acquire() blocks until a token is available."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_s = (1 - self.tokens) / self.rate
+            time.sleep(wait_s)
+
+def add_recipients(phones):
+    with DB_LOCK:
+        conn = get_db()
+        conn.executemany('''INSERT INTO wa_recipients (phone) VALUES (?)
+                              ON CONFLICT (phone) DO UPDATE SET active = 1, updated_at = CURRENT_TIMESTAMP''',
+                         [(clean_phone_number(p),) for p in phones])
+        conn.commit()
+
+def remove_recipients(phones):
+    with DB_LOCK:
+        conn = get_db()
+        conn.executemany("UPDATE wa_recipients SET active = 0, updated_at = CURRENT_TIMESTAMP WHERE phone = ?",
+                         [(clean_phone_number(p),) for p in phones])
+        conn.commit()
+
+def active_recipients():
+    """[(phone, mode)] for active subscribers; mode is 'text' or 'template'."""
+    with DB_LOCK:
+        return get_db().execute("SELECT phone, mode FROM wa_recipients WHERE active = 1 ORDER BY phone").fetchall()
+
+def _record_delivery(digest_id, phone, status, error_code=None, mode=None):
+    with DB_LOCK:
+        conn = get_db()
+        conn.execute('''INSERT INTO wa_deliveries (digest_id, phone, status, error_code, attempts, updated_at)
+                          VALUES (?, ?, ?, ?, 1, CURRENT_TIMESTAMP)
+                          ON CONFLICT (digest_id, phone) DO UPDATE SET status = excluded.status,
+                          error_code = excluded.error_code, attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP''',
+                     (digest_id, phone, status, error_code))
+        conn.execute('''UPDATE wa_recipients SET last_status = ?, last_error_code = ?, mode = COALESCE(?, mode),
+                          updated_at = CURRENT_TIMESTAMP WHERE phone = ?''', (status, error_code, mode, phone))
+        conn.commit()
+
+def _send_to_recipient(message, digest_id, phone, mode, bucket, template_name):
+    """Sends every chunk to one subscriber, in order. A closed 24h window (131047) switches the
+    subscriber to template mode for good and retries right away, but only when a template is
+    configured; without one the subscriber stays in text mode so it is retried once the window reopens.
+    Only the chunks not yet delivered are re-rendered as templates."""
+    if mode == 'template' and not template_name:
+        mode = 'text'
+    payloads = whatsapp_payloads(message, phone, template_name if mode == 'template' else None)
+    for n, payload in enumerate(payloads):
+        attempts = 0
+        while True:
+            bucket.acquire()
+            try:
+                ok, retry_after, _, err_code = _whatsapp_post(payload)
+            except Exception:
+                ok, retry_after, err_code = False, DELIVERY_BACKOFF, None
+            attempts += 1
+            if ok:
+                break
+            if err_code == WHATSAPP_WINDOW_CLOSED and mode == 'text' and template_name:
+                _record_delivery(digest_id, phone, 'failed', err_code, mode='template')
+                unsent = [p["text"]["body"] for p in payloads[n:]]
+                return _send_to_recipient(unsent, digest_id, phone, 'template', bucket, template_name)
+            if retry_after is not None and attempts < DELIVERY_MAX_ATTEMPTS:
+                time.sleep(min(retry_after, DELIVERY_MAX_BACKOFF))
+                continue
+            _record_delivery(digest_id, phone, 'failed', err_code)
+            return False
+    _record_delivery(digest_id, phone, 'sent')
+    return True
+
+def broadcast_whatsapp(message, digest_id):
+    """Sends the digest to every active subscriber that has not received this digest yet.
+    Returns True if at least one subscriber got it."""
+    with DB_LOCK:
+        done = {row[0] for row in get_db().execute(
+            "SELECT phone FROM wa_deliveries WHERE digest_id = ? AND status = 'sent'", (digest_id,))}
+    recipients = [(phone, mode) for phone, mode in active_recipients() if phone not in done]
+    if not recipients:
+        return bool(done)
+    template_name = os.getenv('WHATSAPP_TEMPLATE_NAME')
+    bucket = TokenBucket(WA_BROADCAST_RATE, WA_BROADCAST_BURST)
+    started = time.monotonic()
+    with TracedExecutor(max_workers=WA_BROADCAST_WORKERS) as pool:
+        results = list(pool.map(lambda r: _send_to_recipient(message, digest_id, r[0], r[1], bucket, template_name),
+                                recipients))
+    sent = sum(results)
+    print(f"📣 WhatsApp broadcast: {sent}/{len(recipients)} recipients in {time.monotonic() - started:.1f}s"
+          + (f" ({len(done)} already had it)" if done else ""))
+    return sent > 0 or bool(done)
 
 # --- Main Job Logic ---
 def job(mode='all'):
     print(f"⏰ Starting scheduled job ({mode}) at {datetime.now()}...")
+    token = _current_trace.set(RunTrace())
+    TRACE.reset(mode)
+    try:
+        TRACE.status = _run_job(mode)
+    except Exception:
+        TRACE.status = "error"
+        raise
+    finally:
+        emit_run_report()
+        _current_trace.reset(token)
+
+def _run_job(mode):
+    """The digest pipeline; returns the run status recorded in the run report."""
     init_db()
+    resume_outbox()
     
-    all_news = fetch_rss_news() + fetch_reddit_news()
+    started = time.monotonic()
+    with TRACE.span('stage.ingest'):
+        if candidate_pool_is_warm(mode):
+            all_news = load_candidate_pool(mode)
+            print(f"🏊 Loaded {len(all_news)} staged candidates from the pool in {time.monotonic() - started:.1f}s")
+        else:
+            all_news = fetch_all_news(mode)
+            print(f"📥 Ingested {len(all_news)} candidates in {time.monotonic() - started:.1f}s")
+    TRACE.incr('items.candidates', len(all_news))
     
     if not all_news:
-        print("⚠️ No news found! Check connections.")
-        return
+         print(f"⚠️ No fresh items found for mode '{mode}'. Check connections.")
+         return "no_items"
 
-    if mode == 'research':
-        all_news = [n for n in all_news if n.get('type') == 'research']
-    elif mode == 'news':
-        all_news = [n for n in all_news if n.get('type') == 'news']
-    
-    if not all_news:
-         print(f"⚠️ No fresh items found for mode '{mode}'.")
-         return
+    # Best candidates first; generate_digest packs them into the prompt up to PROMPT_TOKEN_BUDGET
+    with TRACE.span('stage.rank'):
+        all_news = drop_archived_stories(rank_candidates(all_news, mode))
 
-    all_news.sort(key=lambda x: x.get('published_at', ''), reverse=True)
+    with TRACE.span('stage.generate'):
+        digest_data = generate_digest(all_news, mode)
     
-    # Cap input context to prevent token overload
-    if len(all_news) > 80:
-        all_news = all_news[:80]
+    if not digest_data:
+        print("⚠️ Failed to generate digest.")
+        return "no_digest"
+    TRACE.incr('items.digest', len(digest_data.get('items', [])))
+    with TRACE.span('stage.deliver'):
+        delivered = deliver_digest(digest_data, mode)
+    return "ok" if delivered else "undelivered"
 
-    digest_data = generate_digest(all_news, mode)
-    
-    if digest_data:
-        # 1. Telegram
-        tg_message = format_telegram_digest(digest_data, mode)
-        
-        # Create a WhatsApp Share link that pre-fills the message for easier forwarding
-        import urllib.parse
-        clean_wa_text = format_whatsapp_digest(digest_data, mode)
-        encoded_text = urllib.parse.quote(clean_wa_text)
-        wa_share_url = f"https://api.whatsapp.com/send?text={encoded_text}"
-
-        # Create Forwarding Markup
-        markup = {
-            "inline_keyboard": [
-                [{"text": "🚀 Prepare WhatsApp Post", "url": wa_share_url}],
-                [{"text": "📢 Open Channel", "url": WHATSAPP_CHANNEL_URL}]
-            ]
-        }
+def deliver_digest(digest_data, mode):
+    """Formats and sends a digest, then records its stories as seen if any channel succeeded."""
+    # Resolved once, rendered once per channel; each channel chunks the blocks to its own limits
+    ir = digest_ir(digest_data, mode)
+    tg_message = render_digest(ir, "telegram")
+    wa_message = render_digest(ir, "whatsapp")
 
-        tg_success = send_telegram_message(tg_message, reply_markup=markup)
-        
-        # 2. WhatsApp (Direct Publish)
-        wa_message = format_whatsapp_digest(digest_data, mode)
-        wa_success = send_whatsapp_message(wa_message)
-
-        if tg_success or wa_success:
-             new_urls = [item.get('url') for item in digest_data.get('items', []) if item.get('url')]
-             save_seen_urls(new_urls)
-             print(f"📝 Saved {len(new_urls)} dispatched URLs to SQLite database.")
-    else:
-        print("⚠️ Failed to generate digest.")
+    # Forwarding markup: WhatsApp share links that pre-fill the digest, plus the channel link
+    markup = {
+        "inline_keyboard": share_buttons(wa_message) + [
+            [{"text": "📢 Open Channel", "url": WHATSAPP_CHANNEL_URL}]
+        ]
+    }
+
+    # Telegram and WhatsApp (Direct Publish) are sent concurrently, each in order
+    digest_id = digest_data.get('digest_id')
+    with TracedExecutor(max_workers=2) as pool:
+        tg = pool.submit(send_telegram_message, tg_message, markup, digest_id)
+        wa = pool.submit(send_whatsapp_message, wa_message, digest_id)
+        tg_success, wa_success = tg.result(), wa.result()
+
+    if tg_success or wa_success:
+        record_sent_digest(digest_data, mode)
+    return tg_success or wa_success
+
+def record_sent_digest(digest_data, mode):
+    """Post-send bookkeeping: marks the digest's stories as seen and archives it (both idempotent)."""
+    items = [item for item in digest_data.get('items', []) if item.get('url')]
+    # Also remember the other copies of each sent story and its fingerprint for cross-day dedup
+    new_urls = [item['url'] for item in items] + [u for item in items for u in item.get('alt_urls') or []]
+    fingerprints = {item['url']: item['fingerprint'] for item in items if item.get('fingerprint') is not None}
+    save_seen_urls(new_urls, fingerprints)
+    archive_digest(digest_data, mode)
+    print(f"📝 Saved {len(new_urls)} dispatched URLs to the seen state.")
+
+def replay_digest(digest_id):
+    """Re-sends a stored digest without fetching or calling Gemini."""
+    init_db()
+    mode, data = load_digest(digest_id)
+    if data is None:
+        print(f"❌ No unique stored digest matches '{digest_id}'.")
+        return False
+    print(f"🔁 Replaying digest {digest_id} ({mode}, {len(data.get('items', []))} items)")
+    reset_outbox(data.get('digest_id', digest_id))
+    return deliver_digest(data, mode)
+
+# --- Daemon Mode ---
+JOB_LOCK = threading.Lock()
+_daemon_started = time.time()
+_current_run = None
+
+def record_job_run(mode, status):
+    with DB_LOCK:
+        conn = get_db()
+        conn.execute("INSERT OR REPLACE INTO job_runs (mode, last_run, last_status) VALUES (?, datetime('now'), ?)",
+                     (mode, status))
+        conn.commit()
+
+def last_job_runs():
+    with DB_LOCK:
+        rows = get_db().execute("SELECT mode, last_run, last_status FROM job_runs").fetchall()
+    return {mode: {"last_run": last_run, "status": status} for mode, last_run, status in rows}
+
+def run_job_once(mode, jitter=0):
+    """Runs job(mode) unless another run is in progress. Returns False if it was skipped."""
+    if jitter:
+        time.sleep(random.uniform(0, jitter))
+    global _current_run
+    if not JOB_LOCK.acquire(blocking=False):
+        print(f"⏭️ Skipping '{mode}' run: '{_current_run}' is still in progress")
+        return False
+    _current_run = mode
+    try:
+        job(mode)
+        record_job_run(mode, 'ok')
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        record_job_run(mode, f'error: {e}')
+    finally:
+        _current_run = None
+        JOB_LOCK.release()
+    return True
+
+def start_job_thread(mode, jitter=0):
+    threading.Thread(target=run_job_once, args=(mode, jitter), name=f"job-{mode}", daemon=True).start()
+
+def missed_runs(now=None):
+    """Modes whose most recent scheduled time (within CATCHUP_WINDOW_HOURS) passed without a run."""
+    ist = pytz.timezone('Asia/Kolkata')
+    now = now or datetime.now(ist)
+    runs = last_job_runs()
+    missed = []
+    for mode, times in SCHEDULES.items():
+        for at in filter(None, (t.strip() for t in times.split(','))):
+            hour, minute = map(int, at.split(':'))
+            due = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if due > now:
+                due -= timedelta(days=1)
+            if now - due > timedelta(hours=CATCHUP_WINDOW_HOURS):
+                continue
+            last = runs.get(mode, {}).get("last_run")
+            last_dt = pytz.utc.localize(datetime.strptime(last, "%Y-%m-%d %H:%M:%S")) if last else None
+            if last_dt is None or last_dt < due:
+                missed.append(mode)
+                break
+    return missed
+
+class _DaemonHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        import schedule
+        if self.path.rstrip('/') in ('', '/health'):
+            return self._reply(200, {"status": "ok", "uptime_s": int(time.time() - _daemon_started),
+                                     "running": _current_run, "last_runs": last_job_runs(),
+                                     "next_run": str(schedule.next_run()) if schedule.jobs else None})
+        self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        parts = urllib.parse.urlsplit(self.path)
+        if parts.path.rstrip('/') != '/run':
+            return self._reply(404, {"error": "not found"})
+        if not DAEMON_TRIGGER_TOKEN and not daemon_is_loopback():
+            return self._reply(403, {"error": "POST /run needs DAEMON_TRIGGER_TOKEN when listening beyond loopback"})
+        if DAEMON_TRIGGER_TOKEN and self.headers.get('Authorization') != f"Bearer {DAEMON_TRIGGER_TOKEN}":
+            return self._reply(401, {"error": "unauthorized"})
+        mode = urllib.parse.parse_qs(parts.query).get('mode', ['all'])[0]
+        if mode not in ('all', 'research', 'news'):
+            return self._reply(400, {"error": f"unknown mode '{mode}'"})
+        if _current_run:
+            return self._reply(409, {"error": f"'{_current_run}' run in progress"})
+        start_job_thread(mode)
+        self._reply(202, {"status": "started", "mode": mode})
+
+def daemon_is_loopback():
+    return DAEMON_HOST in ('localhost', '127.0.0.1', '::1') or DAEMON_HOST.startswith('127.')
+
+def run_daemon():
+    """Keeps one warm process (DB connection, HTTP sessions, Gemini client) and runs the research
+    and news jobs on their IST schedules, catching up on runs missed while the process was down."""
+    import schedule
+    init_db()
+    for mode, times in SCHEDULES.items():
+        for at in filter(None, (t.strip() for t in times.split(','))):
+            schedule.every().day.at(at, "Asia/Kolkata").do(start_job_thread, mode, SCHEDULE_JITTER_SECONDS)
+            print(f"🗓️ '{mode}' scheduled daily at {at} IST (±{SCHEDULE_JITTER_SECONDS}s jitter)")
+
+    # Keep the candidate pool warm so scheduled digests skip the network entirely
+    schedule.every(INGEST_TICK_SECONDS).seconds.do(
+        lambda: threading.Thread(target=ingest_tick, name="ingest", daemon=True).start())
+
+    server = ThreadingHTTPServer((DAEMON_HOST, DAEMON_PORT), _DaemonHandler)
+    threading.Thread(target=server.serve_forever, name="daemon-http", daemon=True).start()
+    print(f"🩺 Health/trigger endpoint on http://{DAEMON_HOST}:{DAEMON_PORT} (GET /health, POST /run?mode=news)")
+    if not DAEMON_TRIGGER_TOKEN and not daemon_is_loopback():
+        print("🔒 DAEMON_TRIGGER_TOKEN is not set: POST /run is disabled on a public address")
+
+    ingest_tick()
+    for mode in missed_runs():
+        print(f"⏪ Catching up on missed '{mode}' run")
+        run_job_once(mode)
+
+    try:
+        while True:
+            schedule.run_pending()
+            time.sleep(1)
+    finally:
+        server.shutdown()
 
 if __name__ == "__main__":
     import argparse
+
+    def date_arg(value):
+        try:
+            date_bound(value, end=True)
+        except (ValueError, OverflowError) as e:
+            raise argparse.ArgumentTypeError(str(e))
+        return value
+
     parser = argparse.ArgumentParser(description='Run Tech News Bot')
     parser.add_argument('--mode', type=str, default='all', choices=['all', 'research', 'news'], help='Mode to run: research, news, or all')
+    parser.add_argument('--replay', metavar='DIGEST_ID', help='Re-send a stored digest by its ID (skips fetching and Gemini)')
+    parser.add_argument('--ingest', action='store_true', help='Continuously poll sources into the candidate pool')
+    parser.add_argument('--search', metavar='TEXT', nargs='?', const='', help='Search the archive of sent digest items (e.g. --search llama --since 2026-03 --until 2026-03)')
+    parser.add_argument('--since', metavar='DATE', type=date_arg, help='With --search: from YYYY, YYYY-MM or YYYY-MM-DD')
+    parser.add_argument('--until', metavar='DATE', type=date_arg, help='With --search: through YYYY, YYYY-MM or YYYY-MM-DD')
+    parser.add_argument('--limit', type=int, default=50, help='With --search: maximum results')
+    parser.add_argument('--health', action='store_true', help='Show per-source fetch health and circuit breaker state')
+    parser.add_argument('--add-recipient', metavar='PHONE', nargs='+', help='Subscribe WhatsApp numbers to the broadcast')
+    parser.add_argument('--remove-recipient', metavar='PHONE', nargs='+', help='Unsubscribe WhatsApp numbers')
     args = parser.parse_args()
 
+    if args.ingest:
+        try:
+            run_ingest_loop()
+        except KeyboardInterrupt:
+            print("\n🛑 Ingestion stopped by user.")
+        sys.exit(0)
+
+    if args.search is not None:
+        init_db()
+        print_archive_search(args.search, args.since, args.until, args.mode, args.limit)
+        sys.exit(0)
+
+    if args.health:
+        init_db()
+        print_source_health()
+        sys.exit(0)
+
+    if args.add_recipient or args.remove_recipient:
+        init_db()
+        add_recipients(args.add_recipient or [])
+        remove_recipients(args.remove_recipient or [])
+        print(f"📇 {len(active_recipients())} active WhatsApp recipients")
+        sys.exit(0)
+
+    if args.replay:
+        sys.exit(0 if replay_digest(args.replay) else 1)
+
     if not GEMINI_API_KEY:
         print("🚨 WARNING: GEMINI_API_KEY is missing.")
     if not BOT_TOKEN:
@@ -584,8 +2913,6 @@ if __name__ == "__main__":
              job(args.mode)
              sys.exit(0)
              
-        while True:
-            schedule.run_pending()
-            time.sleep(1)
+        run_daemon()
     except KeyboardInterrupt:
         print("\n🛑 Bot stopped by user.")